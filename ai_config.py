@@ -1,6 +1,7 @@
 import json
+import os
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Tuple
 
 BASE_DIR = Path(__file__).resolve().parent
 AI_CONFIG_PATH = BASE_DIR / "ai_config.json"
@@ -15,6 +16,11 @@ DEFAULT_AI_CONFIG: Dict[str, Any] = {
     "cloud_ai_model": "gpt-4o-mini",
     "cloud_ai_api_key": "",
 }
+_DEFAULT_KEYS = frozenset(DEFAULT_AI_CONFIG)
+# (mtime, clé) remplacé d'un seul bloc
+_LEGACY_KEY_CACHE: Tuple[Optional[int], Optional[str]] = (None, None)
+# (mtimes, config) remplacé d'un seul bloc (jamais de mtimes neufs sans la config)
+_CLIENT_CONFIG_CACHE: Tuple[Optional[tuple], Optional[Dict[str, Any]]] = (None, None)
 
 
 def _read_config_file() -> Dict[str, Any]:
@@ -27,30 +33,43 @@ def _read_config_file() -> Dict[str, Any]:
 
 
 def _write_config_file(config: Dict[str, Any]) -> None:
+    data = json.dumps(config, indent=2, sort_keys=True).encode("utf-8")
+    try:
+        if AI_CONFIG_PATH.read_bytes() == data:
+            return  # rien n'a changé, pas de réécriture
+    except OSError:
+        pass
     AI_CONFIG_PATH.parent.mkdir(parents=True, exist_ok=True)
-    AI_CONFIG_PATH.write_text(json.dumps(config, indent=2), encoding="utf-8")
+    tmp_path = AI_CONFIG_PATH.with_suffix(".json.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, AI_CONFIG_PATH)
 
 
 def _load_legacy_openai_key() -> Optional[str]:
-    if not LEGACY_OPENAI_KEY_PATH.exists():
+    global _LEGACY_KEY_CACHE
+    try:
+        mtime = LEGACY_OPENAI_KEY_PATH.stat().st_mtime_ns
+    except OSError:
         return None
+    cached_mtime, cached_key = _LEGACY_KEY_CACHE
+    if cached_mtime == mtime:
+        return cached_key
     try:
-        key = LEGACY_OPENAI_KEY_PATH.read_text(encoding="utf-8").strip()
-        return key or None
+        key = LEGACY_OPENAI_KEY_PATH.read_text(encoding="utf-8").strip() or None
     except OSError:
         return None
+    _LEGACY_KEY_CACHE = (mtime, key)
+    return key
 
 
 def _merge_with_defaults(raw: Dict[str, Any], *, include_secrets: bool) -> Dict[str, Any]:
-    config = dict(DEFAULT_AI_CONFIG)
-    for key, value in raw.items():
-        if key not in config:
-            continue
-        if isinstance(value, str):
-            config[key] = value.strip()
-        else:
-            config[key] = value
-    legacy_key = _load_legacy_openai_key()
+    config = DEFAULT_AI_CONFIG | {
+        key: value.strip() if isinstance(value, str) else value
+        for key, value in raw.items()
+        if key in _DEFAULT_KEYS
+    }
+    # La clé legacy n'est consultée que si ai_config.json n'en contient pas
+    legacy_key = None if raw.get("cloud_ai_api_key") else _load_legacy_openai_key()
     if not config.get("cloud_ai_api_key") and legacy_key:
         config["cloud_ai_api_key"] = legacy_key
     ai_mode = str(config.get("ai_mode") or "").lower()
@@ -71,6 +90,7 @@ def load_ai_config(*, include_secrets: bool = True) -> Dict[str, Any]:
 
 
 def save_ai_config(payload: Dict[str, Any]) -> Dict[str, Any]:
+    global _CLIENT_CONFIG_CACHE
     if not isinstance(payload, dict):
         raise ValueError("Configuration IA invalide.")
     current = _read_config_file()
@@ -103,8 +123,24 @@ def save_ai_config(payload: Dict[str, Any]) -> Dict[str, Any]:
         merged[key] = _normalize_str(value)
 
     _write_config_file(merged)
-    return load_ai_config(include_secrets=False)
+    _CLIENT_CONFIG_CACHE = (None, None)
+    return _merge_with_defaults(merged, include_secrets=False)
+
+
+def _mtime_ns(path: Path) -> Optional[int]:
+    try:
+        return path.stat().st_mtime_ns
+    except OSError:
+        return None
 
 
 def load_ai_config_for_client() -> Dict[str, Any]:
-    return load_ai_config(include_secrets=False)
+    global _CLIENT_CONFIG_CACHE
+    # Relu uniquement si ai_config.json ou la clé legacy ont changé sur disque
+    mtimes = (_mtime_ns(AI_CONFIG_PATH), _mtime_ns(LEGACY_OPENAI_KEY_PATH))
+    cached_mtimes, cached_config = _CLIENT_CONFIG_CACHE
+    if cached_mtimes == mtimes and cached_config is not None:
+        return dict(cached_config)  # copie : l'appelant ne modifie pas le cache
+    config = load_ai_config(include_secrets=False)
+    _CLIENT_CONFIG_CACHE = (mtimes, config)
+    return dict(config)
@@ -1,17 +1,31 @@
+import copy
 import json
 import logging
 import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from math import fsum
 from pathlib import Path
-from statistics import mean
-from typing import Any, Dict, Iterable, List, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, TypedDict
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from influxdb_client import InfluxDBClient
 from influxdb_client.client.flux_table import FluxRecord
 
 from ai_config import load_ai_config
 
+try:
+    import orjson  # type: ignore
+except Exception:
+    orjson = None
+
 
 BASE_DIR = Path(__file__).resolve().parent
 ANALYSIS_QUERIES_PATH = BASE_DIR / "analysis_queries.json"
@@ -23,6 +37,27 @@ BUCKET_BY_PERIOD = {
     "last_month": "1d",
     "last_year": "1mo",
 }
+BUCKET_SECONDS = {
+    "6h": 6 * 3600,
+    "1d": 24 * 3600,
+}
+MANUAL_WATER_FIELDS = ("no3", "no2", "gh", "kh", "cl2", "po4")
+RELEVANT_EVENT_TYPES = frozenset({"pump", "relay", "heater", "peristaltic_power", "feeder_webhook"})
+MAX_RELEVANT_EVENTS = 50
+STATE_FIELDS = frozenset({"state", "state_int"})
+PERISTALTIC_DEVICE_TYPES = frozenset({"pump", "peristaltic_power"})
+HEATER_DEVICE_TYPES = frozenset({"heater", "heater_zone"})
+# Tags à faible cardinalité : une seule instance de chaque chaîne pour toutes les lignes
+INTERNED_TAG_KEYS = (
+    "device_type",
+    "device_id",
+    "sensor_id",
+    "sensor_name",
+    "axis",
+    "setting_group",
+    "setting_name",
+    "source",
+)
 PERIOD_OFFSETS = {
     "last_3_days": (-3, 0),
     "last_week": (-7, -3),
@@ -30,6 +65,12 @@ PERIOD_OFFSETS = {
     "last_year": (-365, -30),
 }
 
+# Seules les colonnes lues par les synthèses transitent depuis Influx
+_FLUX_KEEP_LINE = (
+    '  |> keep(columns: ["_time", "_value", "_field", "_measurement", "sensor_id", "sensor_name", '
+    '"device_type", "device_id", "axis", "volume_ml", "state", "source", "setting_group", "setting_name"])\n'
+)
+
 
 DEFAULT_QUERIES: Dict[str, str] = {
     "last_3_days": f"""
@@ -40,7 +81,7 @@ from(bucket: "{DEFAULT_BUCKET}")
       r["_measurement"] == "device_events" or
       r["_measurement"] == "settings" or
       r["_measurement"] == "water_quality_manual")
-""",
+{_FLUX_KEEP_LINE}""",
     "last_week": f"""
 from(bucket: "{DEFAULT_BUCKET}")
   |> range(start: -7d)
@@ -49,7 +90,7 @@ from(bucket: "{DEFAULT_BUCKET}")
       r["_measurement"] == "device_events" or
       r["_measurement"] == "settings" or
       r["_measurement"] == "water_quality_manual")
-""",
+{_FLUX_KEEP_LINE}""",
     "last_month": f"""
 from(bucket: "{DEFAULT_BUCKET}")
   |> range(start: -30d)
@@ -58,7 +99,7 @@ from(bucket: "{DEFAULT_BUCKET}")
       r["_measurement"] == "device_events" or
       r["_measurement"] == "settings" or
       r["_measurement"] == "water_quality_manual")
-""",
+{_FLUX_KEEP_LINE}""",
     "last_year": f"""
 from(bucket: "{DEFAULT_BUCKET}")
   |> range(start: -365d)
@@ -67,106 +108,231 @@ from(bucket: "{DEFAULT_BUCKET}")
       r["_measurement"] == "device_events" or
       r["_measurement"] == "settings" or
       r["_measurement"] == "water_quality_manual")
-""",
+{_FLUX_KEEP_LINE}""",
 }
 
+
+class FluxRow(TypedDict):
+    """Ligne Flux normalisée par _record_to_dict."""
+
+    time: Optional[str]
+    moment: Optional[datetime]
+    measurement: str
+    field: str
+    value: Any
+    tags: Dict[str, Any]  # record.values (colonnes réservées "_time", "_value"... incluses)
+    sensor: Optional[str]
+    device_type: Optional[str]
+
+
 _influx_client: Optional[InfluxDBClient] = None
+_influx_client_lock = threading.Lock()
+# (mtime, requêtes) remplacé d'un seul bloc : un lecteur concurrent ne voit jamais un
+# mtime neuf associé à des requêtes absentes ou anciennes
+_QUERIES_CACHE: Tuple[Optional[int], Optional[Dict[str, str]]] = (None, None)
+# période -> (requête, bucket courant, instant monotone du calcul, synthèse) ; une entrée
+# par période connue, périmée dès que la requête ou le bucket change ou après
+# SUMMARY_CACHE_MAX_AGE. Les périodes qui se terminent maintenant ne sont jamais servies
+# depuis le cache (leur bucket ouvert reçoit encore des points).
+_SUMMARY_CACHE: Dict[str, Tuple[str, str, float, Dict[str, Any]]] = {}
+SUMMARY_CACHE_MAX_AGE = 3600.0
+_http_session: Optional[requests.Session] = None
 logger = logging.getLogger("reef.analysis")
 AI_CALL_TIMEOUT = 60
 
 
+def _dumps_compact(data: Any) -> str:
+    """JSON compact (sans indentation) : moins de tokens dans les prompts IA."""
+    if orjson is not None:
+        return orjson.dumps(data).decode("utf-8")
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def _dumps_bytes(data: Any) -> bytes:
+    """Corps de requête JSON encodé une seule fois (orjson si disponible)."""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _dumps_indented(data: Any) -> bytes:
+    """JSON indenté pour les fichiers édités à la main (analysis_queries.json)."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def _loads(data: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
 def _ensure_queries_file() -> None:
     if ANALYSIS_QUERIES_PATH.exists():
         return
-    ANALYSIS_QUERIES_PATH.write_text(json.dumps(DEFAULT_QUERIES, indent=2), encoding="utf-8")
+    _write_queries_file(DEFAULT_QUERIES)
+
+
+def _write_queries_file(queries: Dict[str, str]) -> None:
+    data = _dumps_indented(queries)
+    try:
+        if ANALYSIS_QUERIES_PATH.read_bytes() == data:
+            return  # rien n'a changé, pas de réécriture
+    except OSError:
+        pass
+    # Écriture atomique : jamais de fichier tronqué à relire après un arrêt brutal
+    tmp_path = ANALYSIS_QUERIES_PATH.with_suffix(".json.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, ANALYSIS_QUERIES_PATH)
 
 
 def get_influx_client() -> InfluxDBClient:
     global _influx_client
     if _influx_client:
         return _influx_client
-    url = os.environ.get("INFLUXDB_URL")
-    token = os.environ.get("INFLUXDB_TOKEN")
-    org = os.environ.get("INFLUXDB_ORG")
-    if not all([url, token, org]):
-        raise RuntimeError("Variables InfluxDB manquantes (INFLUXDB_URL, INFLUXDB_TOKEN, INFLUXDB_ORG)")
-    _influx_client = InfluxDBClient(url=url, token=token, org=org)
+    with _influx_client_lock:  # build_summary interroge Influx depuis plusieurs threads
+        if _influx_client:
+            return _influx_client
+        url = os.environ.get("INFLUXDB_URL")
+        token = os.environ.get("INFLUXDB_TOKEN")
+        org = os.environ.get("INFLUXDB_ORG")
+        if not all([url, token, org]):
+            raise RuntimeError("Variables InfluxDB manquantes (INFLUXDB_URL, INFLUXDB_TOKEN, INFLUXDB_ORG)")
+        # gzip : réponses CSV volumineuses (last_year) compressées sur le réseau
+        _influx_client = InfluxDBClient(url=url, token=token, org=org, enable_gzip=True)
     return _influx_client
 
 
+def get_http_session() -> requests.Session:
+    """Session HTTP partagée : connexions keep-alive réutilisées entre appels IA."""
+    global _http_session
+    if _http_session is None:
+        session = requests.Session()
+        # Réessais courts sur 429/503 uniquement (requête refusée avant traitement) ; la
+        # dernière réponse HTTP est rendue telle quelle (raise_on_status=False) pour garder
+        # le message d'erreur. Pas de réessai sur 502/504 ni sur timeout/coupure de lecture :
+        # le fournisseur a pu traiter le POST (complétion facturée en double) ; connexion
+        # refusée : un seul.
+        retries = Retry(
+            total=2,
+            connect=1,
+            read=0,
+            other=0,
+            backoff_factor=0.3,
+            status_forcelist=(429, 503),
+            allowed_methods=frozenset({"POST"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retries)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _http_session = session
+    return _http_session
+
+
 def load_analysis_queries() -> Dict[str, str]:
+    global _QUERIES_CACHE
     _ensure_queries_file()
     try:
-        return json.loads(ANALYSIS_QUERIES_PATH.read_text(encoding="utf-8"))
+        mtime = ANALYSIS_QUERIES_PATH.stat().st_mtime_ns
+    except OSError:
+        mtime = None
+    cached_mtime, cached_queries = _QUERIES_CACHE
+    if mtime is not None and cached_mtime == mtime and cached_queries is not None:
+        return dict(cached_queries)
+    try:
+        queries = _loads(ANALYSIS_QUERIES_PATH.read_bytes())
     except json.JSONDecodeError:
-        ANALYSIS_QUERIES_PATH.write_text(json.dumps(DEFAULT_QUERIES, indent=2), encoding="utf-8")
+        _write_queries_file(DEFAULT_QUERIES)
         return DEFAULT_QUERIES.copy()
+    if isinstance(queries, dict):
+        # Mise à niveau en mémoire seulement : le fichier n'est réécrit que par save_analysis_queries
+        _upgrade_default_queries(queries)
+    _QUERIES_CACHE = (mtime, queries)
+    return dict(queries)
+
+
+def _upgrade_default_queries(queries: Dict[str, str]) -> bool:
+    """Remplace les requêtes restées identiques aux anciennes requêtes par défaut (sans
+    keep) ; les requêtes modifiées par l'utilisateur ne sont pas touchées."""
+    upgraded = False
+    for period, query in DEFAULT_QUERIES.items():
+        if queries.get(period) == query.replace(_FLUX_KEEP_LINE, ""):
+            queries[period] = query
+            upgraded = True
+    return upgraded
 
 
 def save_analysis_queries(payload: Dict[str, str]) -> Dict[str, str]:
+    global _QUERIES_CACHE
     if not isinstance(payload, dict):
         raise ValueError("Format de requêtes invalide.")
     for key, value in payload.items():
         if key not in DEFAULT_QUERIES:
             raise ValueError(f"Période inconnue: {key}")
-        if not isinstance(value, str) or not value.strip():
+        if not isinstance(value, str) or not value or value.isspace():
             raise ValueError(f"Requête vide pour {key}")
-    ANALYSIS_QUERIES_PATH.write_text(json.dumps(payload, indent=2), encoding="utf-8")
+    _write_queries_file(payload)
+    _QUERIES_CACHE = (None, None)
+    _SUMMARY_CACHE.clear()
     return payload
 
 
-def run_flux_query(query: str) -> List[Dict[str, Any]]:
+def run_flux_query(query: str) -> List[FluxRow]:
+    """Lignes de la requête, triées dans l'ordre chronologique."""
     client = get_influx_client()
     query_api = client.query_api()
+    # query_stream décode le CSV au fil de l'eau au lieu de construire des FluxTable
     try:
-        tables = query_api.query(query=query)
+        rows = [_record_to_dict(record) for record in query_api.query_stream(query=query)]
     except Exception as exc:  # pragma: no cover - defensive branch
         raise RuntimeError(f"Flux query failed: {exc}") from exc
-    rows: List[Dict[str, Any]] = []
-    for table in tables:
-        for record in table.records:
-            rows.append(_record_to_dict(record))
-    rows.sort(key=lambda item: item.get("time") or "")
+    rows.sort(key=lambda row: row["time"] or "")
     return rows
 
 
-def _record_to_dict(record: FluxRecord) -> Dict[str, Any]:
-    tags = {
-        key: value
-        for key, value in record.values.items()
-        if key not in {"_time", "_value", "_measurement", "_field", "result", "table"}
-    }
+def _record_to_dict(record: FluxRecord) -> FluxRow:
+    # Les tags ne sont lus que par clé : on référence record.values sans le recopier
+    tags = record.values
+    for key in INTERNED_TAG_KEYS:
+        value = tags.get(key)
+        if type(value) is str:
+            tags[key] = sys.intern(value)
+    moment = record.get_time()
     return {
-        "time": record.get_time().isoformat() if record.get_time() else None,
-        "measurement": record.get_measurement(),
-        "field": record.get_field(),
+        "time": moment.isoformat() if moment else None,
+        "moment": moment,
+        "measurement": sys.intern(record.get_measurement() or ""),
+        "field": sys.intern(record.get_field() or ""),
         "value": record.get_value(),
         "tags": tags,
+        # Tags consultés par chaque synthèse, résolus une fois à l'ingestion
+        "sensor": tags.get("sensor_id") or tags.get("sensor_name"),
+        "device_type": tags.get("device_type"),
     }
 
 
-def fetch_history(period: str) -> Dict[str, Any]:
-    queries = load_analysis_queries()
+def fetch_history(period: str, queries: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    if queries is None:
+        queries = load_analysis_queries()
     if period not in queries:
         raise ValueError(f"Période inconnue: {period}")
-    rows = run_flux_query(queries[period])
-    earliest_time = None
-    for row in rows:
-        ts = row.get("time")
-        if not ts:
-            continue
-        if earliest_time is None or ts < earliest_time:
-            earliest_time = ts
-    grouped: Dict[str, List[Dict[str, Any]]] = {
+    grouped: Dict[str, List[FluxRow]] = {
         "sensor_readings": [],
         "device_events": [],
         "settings": [],
         "water_quality_manual": [],
     }
-    for row in rows:
-        measurement = row.get("measurement")
-        if measurement in grouped:
-            grouped[measurement].append(row)
+    # Regroupement dans l'ordre du tri : le premier horodatage renseigné rencontré est
+    # le plus ancien.
+    earliest_time = None
+    for row in run_flux_query(queries[period]):
+        if earliest_time is None and row["time"]:
+            earliest_time = row["time"]
+        bucket = grouped.get(row["measurement"])
+        if bucket is not None:
+            bucket.append(row)
     return {
         "series": grouped,
         "earliest_time": earliest_time,
@@ -174,78 +340,124 @@ def fetch_history(period: str) -> Dict[str, Any]:
 
 
 def build_summary(periods: List[str]) -> Dict[str, Any]:
+    now = datetime.now(timezone.utc)
     summary: Dict[str, Any] = {
-        "generated_at": datetime.utcnow().replace(tzinfo=timezone.utc).isoformat(),
+        "generated_at": now.isoformat(),
         "periods": {},
     }
-    now = datetime.utcnow().replace(tzinfo=timezone.utc)
+    queries = load_analysis_queries()
+    for period in periods:
+        if period not in queries:
+            raise ValueError(f"Période inconnue: {period}")
+    # Requêtes Flux lancées en parallèle (I/O) ; une requête partagée par plusieurs
+    # périodes n'est exécutée qu'une fois. La synthèse reste séquentielle.
+    cached: Dict[str, Dict[str, Any]] = {}
+    for period in periods:
+        entry = _SUMMARY_CACHE.get(period)
+        if (
+            entry is not None
+            and entry[0] == queries[period]
+            and entry[1] == _summary_cache_bucket(period, now)
+            and time.monotonic() - entry[2] < SUMMARY_CACHE_MAX_AGE
+        ):
+            cached[period] = entry[3]
+    first_period_by_query = {}
+    for period in periods:
+        if period not in cached:
+            first_period_by_query.setdefault(queries[period], period)
+    with ThreadPoolExecutor(max_workers=max(1, min(4, len(first_period_by_query)))) as executor:
+        futures = {
+            query: executor.submit(fetch_history, period, queries)
+            for query, period in first_period_by_query.items()
+        }
+        histories = {query: future.result() for query, future in futures.items()}
     for period in periods:
-        history = fetch_history(period)
-        series = history["series"]
-        earliest_time = history.get("earliest_time")
-        bucket_size = BUCKET_BY_PERIOD.get(period, "6h")
         start_offset, end_offset = PERIOD_OFFSETS.get(period, (-3, 0))
         period_start = now + timedelta(days=start_offset)
         period_end = now + timedelta(days=end_offset)
+        if period in cached:
+            # Copie : l'appelant peut modifier la synthèse sans toucher au cache
+            period_summary = copy.deepcopy(cached[period])
+            period_summary["range"] = {"start": period_start.isoformat(), "end": period_end.isoformat()}
+            summary["periods"][period] = period_summary
+            continue
+        history = histories[queries[period]]
+        series = history["series"]
+        earliest_time = history.get("earliest_time")
+        bucket_size = BUCKET_BY_PERIOD.get(period, "6h")
+        sensor_fields = _partition_by_field(series["sensor_readings"])
+        manual_fields = _partition_by_field(series["water_quality_manual"])
         period_summary = {
-            "temperatures": _summarize_temperatures(series["sensor_readings"]),
-            "ph": _summarize_ph(series["sensor_readings"]),
-            "lux": _summarize_lux(series["sensor_readings"]),
-            "water_levels": _summarize_levels(series["sensor_readings"]),
-            "relay_states": _summarize_relays(series["device_events"]),
-            "peristaltic": _summarize_peristaltic(series["device_events"]),
-            "heater": _summarize_heater(series["device_events"]),
-            "manual_water_quality": _summarize_manual_water(series["water_quality_manual"]),
+            **_summarize_sensor_readings(sensor_fields),
+            "water_levels": _summarize_levels(sensor_fields),
+            **_summarize_device_events(series["device_events"]),
+            "manual_water_quality": _summarize_manual_water(manual_fields),
             "settings": _summarize_settings(series["settings"]),
             "device_events": _list_relevant_events(series["device_events"]),
             "earliest_time": earliest_time,
             "range": {"start": period_start.isoformat(), "end": period_end.isoformat()},
             "timelines": {
-                "sensor_buckets": _aggregate_sensor_buckets(series["sensor_readings"], bucket_size),
-                "manual_water_buckets": _aggregate_manual_water_buckets(
-                    series["water_quality_manual"], bucket_size
-                ),
+                "sensor_buckets": _aggregate_sensor_buckets(sensor_fields, bucket_size),
+                "manual_water_buckets": _aggregate_manual_water_buckets(manual_fields, bucket_size),
                 "device_event_buckets": _aggregate_device_event_buckets(
                     series["device_events"], bucket_size
                 ),
             },
         }
         summary["periods"][period] = period_summary
+        if end_offset < 0:
+            _SUMMARY_CACHE[period] = (
+                queries[period],
+                _summary_cache_bucket(period, now),
+                time.monotonic(),
+                copy.deepcopy(period_summary),
+            )
     return summary
 
 
-def _summarize_temperatures(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
-    sensors: Dict[str, List[float]] = {}
+def _summary_cache_bucket(period: str, now: datetime) -> str:
+    """Bucket (granularité de la période) contenant `now` : la synthèse d'une période est
+    réutilisée tant qu'on reste dans le même bucket de sa chronologie."""
+    granularity = BUCKET_BY_PERIOD.get(period, "6h")
+    window = _BUCKET_WINDOWS.get(granularity, _fixed_window)
+    return window(now.timestamp(), BUCKET_SECONDS.get(granularity, 3600))[2]
+
+
+def _partition_by_field(rows: List[FluxRow]) -> Dict[str, List[FluxRow]]:
+    """Répartit les lignes par champ en une passe (ordre chronologique conservé)."""
+    fields: Dict[str, List[FluxRow]] = {}
     for row in rows:
-        if row["field"] != "celsius":
-            continue
-        sensor = row["tags"].get("sensor_id") or row["tags"].get("sensor_name", "unknown")
-        value = row.get("value")
-        if isinstance(value, (int, float)):
-            sensors.setdefault(sensor, []).append(value)
-    return {sensor: _basic_stats(values) for sensor, values in sensors.items() if values}
+        fields.setdefault(row["field"], []).append(row)
+    return fields
 
 
-def _summarize_ph(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
-    ph_values = [row["value"] for row in rows if row["field"] == "ph" and isinstance(row["value"], (int, float))]
-    voltage_values = [row["value"] for row in rows if row["field"] == "voltage" and isinstance(row["value"], (int, float))]
-    return {
-        "ph": _basic_stats(ph_values),
-        "voltage": _basic_stats(voltage_values),
-    }
+def _numeric_values(rows: List[FluxRow]) -> List[float]:
+    return [float(row["value"]) for row in rows if isinstance(row["value"], (int, float))]
 
 
-def _summarize_lux(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
-    lux_values = [row["value"] for row in rows if row["field"] == "lux" and isinstance(row["value"], (int, float))]
-    return _basic_stats(lux_values)
+def _summarize_sensor_readings(fields: Dict[str, List[FluxRow]]) -> Dict[str, Any]:
+    """Températures, pH et luminosité à partir des lignes déjà réparties par champ."""
+    temperatures: Dict[str, List[float]] = {}
+    for row in fields.get("celsius", ()):
+        value = row["value"]
+        if isinstance(value, (int, float)):
+            sensor = row["sensor"] or "unknown"
+            temperatures.setdefault(sensor, []).append(float(value))
+    series = {name: _numeric_values(fields.get(name, [])) for name in ("ph", "voltage", "lux")}
+    return {
+        "temperatures": {sensor: _basic_stats(values) for sensor, values in temperatures.items() if values},
+        "ph": {
+            "ph": _basic_stats(series["ph"]),
+            "voltage": _basic_stats(series["voltage"]),
+        },
+        "lux": _basic_stats(series["lux"]),
+    }
 
 
-def _summarize_levels(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+def _summarize_levels(fields: Dict[str, List[FluxRow]]) -> Dict[str, Any]:
     latest: Dict[str, Dict[str, Any]] = {}
-    for row in rows:
-        if row["field"] not in {"state", "state_text"}:
-            continue
-        sensor = row["tags"].get("sensor_id") or row["tags"].get("sensor_name")
+    for row in fields.get("state", []) + fields.get("state_text", []):
+        sensor = row["sensor"]
         if not sensor:
             continue
         latest.setdefault(sensor, {})
@@ -253,70 +465,61 @@ def _summarize_levels(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
     return latest
 
 
-def _summarize_relays(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+def _summarize_device_events(rows: List[FluxRow]) -> Dict[str, Any]:
+    """Relais, pompes péristaltiques et chauffage synthétisés en une seule passe."""
     relays: Dict[str, Dict[str, Any]] = {}
-    for row in rows:
-        if row["measurement"] != "device_events":
-            continue
-        if row["tags"].get("device_type") != "relay":
-            continue
-        device_id = row["tags"].get("device_id", "relay")
-        state = row["value"] if row["field"] in {"state", "state_int"} else row["tags"].get("state")
-        relays[device_id] = {"field": row["field"], "value": state, "time": row["time"]}
-    return relays
-
-
-def _summarize_peristaltic(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
     volume_per_axis: Dict[str, float] = {}
     activations: Dict[str, int] = {}
-    for row in rows:
-        dtype = row["tags"].get("device_type")
-        if dtype not in {"pump", "peristaltic_power"}:
-            continue
-        axis = row["tags"].get("axis") or row["tags"].get("device_id", "unknown")
-        if "volume_ml" in row["tags"]:
-            try:
-                volume = float(row["tags"]["volume_ml"])
-                volume_per_axis[axis] = volume_per_axis.get(axis, 0.0) + volume
-            except (TypeError, ValueError):
-                pass
-        if row["field"] in {"state", "state_int"}:
-            activations[axis] = activations.get(axis, 0) + 1
-    return {"volumes_ml": volume_per_axis, "activations": activations}
-
-
-def _summarize_heater(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
-    heater_events = [
-        row
-        for row in rows
-        if row["tags"].get("device_type") in {"heater", "heater_zone"}
-    ]
-    latest_state = None
+    heater_state = None
     hysteresis = None
-    for row in heater_events:
-        if row["field"] in {"state", "state_int"}:
-            latest_state = {"value": row["value"], "time": row["time"], "zone": row["tags"].get("device_id")}
-        if row["field"] == "hysteresis":
-            hysteresis = row["value"]
-    return {"latest_state": latest_state, "hysteresis": hysteresis}
+    for row in rows:
+        dtype = row["device_type"]
+        field = row["field"]
+        if dtype == "relay":
+            tags = row["tags"]
+            device_id = tags.get("device_id", "relay")
+            state = row["value"] if field in STATE_FIELDS else tags.get("state")
+            relays[device_id] = {"field": field, "value": state, "time": row["time"]}
+        elif dtype in PERISTALTIC_DEVICE_TYPES:
+            tags = row["tags"]
+            axis = tags.get("axis") or tags.get("device_id", "unknown")
+            if "volume_ml" in tags:
+                try:
+                    volume = float(tags["volume_ml"])
+                    volume_per_axis[axis] = volume_per_axis.get(axis, 0.0) + volume
+                except (TypeError, ValueError):
+                    pass
+            if field in STATE_FIELDS:
+                activations[axis] = activations.get(axis, 0) + 1
+        elif dtype in HEATER_DEVICE_TYPES:
+            if field in STATE_FIELDS:
+                heater_state = {"value": row["value"], "time": row["time"], "zone": row["tags"].get("device_id")}
+            if field == "hysteresis":
+                hysteresis = row["value"]
+    return {
+        "relay_states": relays,
+        "peristaltic": {"volumes_ml": volume_per_axis, "activations": activations},
+        "heater": {"latest_state": heater_state, "hysteresis": hysteresis},
+    }
 
 
-def _summarize_manual_water(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+def _summarize_manual_water(fields: Dict[str, List[FluxRow]]) -> Dict[str, Any]:
     metrics = {}
-    for row in rows:
-        field = row["field"]
-        value = row["value"]
-        if field in {"no3", "no2", "gh", "kh", "cl2", "po4"} and isinstance(value, (int, float)):
-            metrics.setdefault(field, []).append({"value": value, "time": row["time"]})
+    for field in MANUAL_WATER_FIELDS:
+        for row in fields.get(field, ()):
+            value = row["value"]
+            if isinstance(value, (int, float)):
+                metrics.setdefault(field, []).append({"value": value, "time": row["time"]})
     latest = {name: series[-1] for name, series in metrics.items() if series}
     return {"latest": latest, "history": metrics}
 
 
-def _summarize_settings(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+def _summarize_settings(rows: List[FluxRow]) -> Dict[str, Any]:
     summary: Dict[str, Any] = {}
     for row in rows:
-        group = row["tags"].get("setting_group")
-        name = row["tags"].get("setting_name")
+        tags = row["tags"]
+        group = tags.get("setting_group")
+        name = tags.get("setting_name")
         if not group or not name:
             continue
         group_entry = summary.setdefault(group, {})
@@ -344,51 +547,51 @@ def _resolve_setting_value(summary: Dict[str, Any], group: str, name: str) -> Op
     return entry.get("value")
 
 
-def _list_relevant_events(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def _list_relevant_events(rows: List[FluxRow], limit: int = MAX_RELEVANT_EVENTS) -> List[Dict[str, Any]]:
+    """Derniers événements utiles (au plus `limit`), en ordre chronologique."""
     interesting = []
-    topics = {"pump", "relay", "heater", "peristaltic_power", "feeder_webhook"}
-    for row in rows:
-        if row["tags"].get("device_type") in topics:
+    for row in reversed(rows):
+        if len(interesting) >= limit:
+            break
+        if row["device_type"] in RELEVANT_EVENT_TYPES:
+            tags = row["tags"]
             interesting.append(
                 {
                     "time": row["time"],
-                    "device_type": row["tags"].get("device_type"),
-                    "device_id": row["tags"].get("device_id"),
+                    "device_type": row["device_type"],
+                    "device_id": tags.get("device_id"),
                     "field": row["field"],
                     "value": row["value"],
-                    "source": row["tags"].get("source"),
-                    "extra": row["tags"],
+                    "source": tags.get("source"),
                 }
             )
+    interesting.reverse()
     return interesting
 
 
-def _basic_stats(values: Iterable[float]) -> Dict[str, Any]:
-    series = [float(val) for val in values if isinstance(val, (int, float))]
+def _basic_stats(series: List[float]) -> Dict[str, Any]:
+    """Statistiques d'une série de floats déjà filtrée et convertie par l'appelant."""
     if not series:
         return {}
+    # fsum/len plutôt que statistics.mean (arithmétique exacte en fractions, très lente)
     return {
         "min": min(series),
         "max": max(series),
-        "avg": mean(series),
+        "avg": fsum(series) / len(series),
         "trend": series[-1] - series[0] if len(series) > 1 else 0.0,
         "latest": series[-1],
     }
 
 
-def _aggregate_sensor_buckets(rows: List[Dict[str, Any]], granularity: str) -> List[Dict[str, Any]]:
+def _aggregate_sensor_buckets(
+    fields: Dict[str, List[FluxRow]], granularity: str
+) -> List[Dict[str, Any]]:
     bucket_map: Dict[str, Dict[str, Dict[str, List[float]]]] = {}
-    for row in rows:
-        field = row.get("field")
-        if field not in {"celsius", "ph", "voltage", "lux"}:
-            continue
-        value = row.get("value")
+    for field, bucket_key, row in _iter_field_buckets(fields, ("celsius", "ph", "voltage", "lux"), granularity):
+        value = row["value"]
         if not isinstance(value, (int, float)):
             continue
-        bucket_key = _bucket_key(row.get("time"), granularity)
-        if not bucket_key:
-            continue
-        sensor = row["tags"].get("sensor_id") or row["tags"].get("sensor_name") or field
+        sensor = row["sensor"] or field
         bucket_entry = bucket_map.setdefault(bucket_key, {})
         sensor_entry = bucket_entry.setdefault(sensor, {})
         sensor_entry.setdefault(field, []).append(float(value))
@@ -406,19 +609,14 @@ def _aggregate_sensor_buckets(rows: List[Dict[str, Any]], granularity: str) -> L
     return results
 
 
-def _aggregate_manual_water_buckets(rows: List[Dict[str, Any]], granularity: str) -> List[Dict[str, Any]]:
-    allowed_fields = {"no3", "no2", "gh", "kh", "cl2", "po4"}
+def _aggregate_manual_water_buckets(
+    fields: Dict[str, List[FluxRow]], granularity: str
+) -> List[Dict[str, Any]]:
     bucket_map: Dict[str, Dict[str, List[float]]] = {}
-    for row in rows:
-        field = row.get("field")
-        if field not in allowed_fields:
-            continue
-        value = row.get("value")
+    for field, bucket_key, row in _iter_field_buckets(fields, MANUAL_WATER_FIELDS, granularity):
+        value = row["value"]
         if not isinstance(value, (int, float)):
             continue
-        bucket_key = _bucket_key(row.get("time"), granularity)
-        if not bucket_key:
-            continue
         bucket_map.setdefault(bucket_key, {}).setdefault(field, []).append(float(value))
     results = []
     for bucket_key in sorted(bucket_map.keys()):
@@ -435,58 +633,70 @@ def _aggregate_manual_water_buckets(rows: List[Dict[str, Any]], granularity: str
     return results
 
 
-def _aggregate_device_event_buckets(rows: List[Dict[str, Any]], granularity: str) -> List[Dict[str, Any]]:
-    bucket_map: Dict[str, Dict[str, Any]] = {}
+def _iter_field_buckets(fields: Dict[str, List[FluxRow]], names: Iterable[str], granularity: str):
+    for name in names:
+        for bucket_key, row in _iter_bucketed(fields.get(name, ()), granularity):
+            yield name, bucket_key, row
+
+
+def _iter_bucketed(rows: Iterable[FluxRow], granularity: str) -> Iterator[Tuple[str, FluxRow]]:
+    """(clé de bucket, ligne) ; les lignes étant triées par date, la fenêtre courante est
+    réutilisée tant que l'horodatage y reste et la clé n'est recalculée qu'en la quittant."""
+    window = _BUCKET_WINDOWS.get(granularity, _fixed_window)
+    size = BUCKET_SECONDS.get(granularity, 3600)
+    window_start = window_end = 0.0
+    bucket_key = ""
     for row in rows:
-        bucket_key = _bucket_key(row.get("time"), granularity)
-        if not bucket_key:
+        moment = row["moment"]
+        if moment is None:
             continue
-        bucket_entry = bucket_map.setdefault(
-            bucket_key, {"total_events": 0, "per_type": {}}
-        )
-        bucket_entry["total_events"] += 1
-        dtype = row["tags"].get("device_type", "unknown")
-        bucket_entry["per_type"][dtype] = bucket_entry["per_type"].get(dtype, 0) + 1
-    results = []
-    for bucket_key in sorted(bucket_map.keys()):
-        results.append(
-            {
-                "bucket_start": bucket_key,
-                "total_events": bucket_map[bucket_key]["total_events"],
-                "per_type": bucket_map[bucket_key]["per_type"],
-            }
-        )
-    return results
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        ts = moment.timestamp()
+        if not window_start <= ts < window_end:
+            window_start, window_end, bucket_key = window(ts, size)
+        yield bucket_key, row
+
+
+def _aggregate_device_event_buckets(rows: List[FluxRow], granularity: str) -> List[Dict[str, Any]]:
+    counts: Counter = Counter()
+    for bucket_key, row in _iter_bucketed(rows, granularity):
+        dtype = row["device_type"]
+        counts[(bucket_key, dtype if dtype is not None else "unknown")] += 1
+    bucket_map: Dict[str, Dict[str, int]] = {}
+    for (bucket_key, dtype), count in counts.items():
+        bucket_map.setdefault(bucket_key, {})[dtype] = count
+    return [
+        {
+            "bucket_start": bucket_key,
+            "total_events": sum(bucket_map[bucket_key].values()),
+            "per_type": bucket_map[bucket_key],
+        }
+        for bucket_key in sorted(bucket_map)
+    ]
 
 
-def _bucket_key(time_str: Optional[str], granularity: str) -> Optional[str]:
-    if not time_str:
-        return None
-    dt = _parse_time(time_str)
-    if dt is None:
-        return None
-    if granularity == "6h":
-        hour = (dt.hour // 6) * 6
-        dt = dt.replace(hour=hour, minute=0, second=0, microsecond=0)
-    elif granularity == "1d":
-        dt = dt.replace(hour=0, minute=0, second=0, microsecond=0)
-    elif granularity == "1mo":
-        dt = dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+def _fixed_window(ts: float, size: int) -> Tuple[float, float, str]:
+    # Troncature entière de l'epoch (UTC) plutôt que datetime.replace
+    start = int(ts) // size * size
+    return start, start + size, _format_bucket_start(start)
+
+
+def _month_window(ts: float, size: int) -> Tuple[float, float, str]:
+    start = datetime.fromtimestamp(ts, timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    if start.month == 12:
+        end = start.replace(year=start.year + 1, month=1)
     else:
-        dt = dt.replace(minute=0, second=0, microsecond=0)
-    return dt.astimezone(timezone.utc).isoformat()
+        end = start.replace(month=start.month + 1)
+    return start.timestamp(), end.timestamp(), start.isoformat()
 
 
-def _parse_time(time_str: str) -> Optional[datetime]:
-    try:
-        if time_str.endswith("Z"):
-            time_str = time_str[:-1] + "+00:00"
-        dt = datetime.fromisoformat(time_str)
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=timezone.utc)
-        return dt.astimezone(timezone.utc)
-    except ValueError:
-        return None
+_BUCKET_WINDOWS = {"1mo": _month_window}
+
+
+@lru_cache(maxsize=4096)
+def _format_bucket_start(epoch_seconds: int) -> str:
+    return datetime.fromtimestamp(epoch_seconds, timezone.utc).isoformat()
 
 
 def _prepare_provider_configs(config: Dict[str, Any]) -> Dict[str, Optional[Dict[str, Any]]]:
@@ -546,12 +756,12 @@ def _call_provider(
     if api_key:
         headers["Authorization"] = f"Bearer {api_key}"
     try:
-        response = requests.post(endpoint, headers=headers, json=payload, timeout=timeout)
+        response = get_http_session().post(endpoint, headers=headers, data=_dumps_bytes(payload), timeout=timeout)
     except requests.exceptions.RequestException as exc:
         raise RuntimeError(f"Connexion IA impossible: {exc}") from exc
     if response.status_code >= 400:
         raise RuntimeError(f"HTTP {response.status_code}: {response.text}")
-    data = response.json()
+    data = _loads(response.content)
     choices = data.get("choices") or []
     if not choices:
         raise RuntimeError("Réponse vide du modèle.")
@@ -635,13 +845,13 @@ def ask_aquarium_ai(
     user_context: str = "",
     client_timestamp: Optional[str] = None,
 ) -> Dict[str, str]:
-    request_time = client_timestamp or datetime.utcnow().replace(tzinfo=timezone.utc).isoformat()
+    request_time = client_timestamp or datetime.now(timezone.utc).isoformat()
     extra_context = user_context.strip()
     context_section = f"\nContexte utilisateur: {extra_context}" if extra_context else ""
     prompt_text = (
         f"Analyse l'état de l'aquarium (requête du {request_time}).\n"
         "JSON:\n"
-        f"{json.dumps(summary_json, ensure_ascii=False, indent=2)}\n\n"
+        f"{_dumps_compact(summary_json)}\n\n"
         "Instructions:\n"
         "1. Analyse générale de l'état du bac.\n"
         "2. Points de vigilance ou tendances remarquées.\n"
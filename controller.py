@@ -1,24 +1,35 @@
-﻿import json
+﻿import atexit
+import json
 import math
 import logging
 import logging.handlers
 import os
 import queue
+import re
+import select
 import subprocess
 import threading
 import time
 import urllib.parse
 from datetime import datetime, timezone
+from functools import lru_cache
 from pathlib import Path
 from typing import Any, Callable, Dict, Optional, Union
 
-from influxdb_client import InfluxDBClient, Point
+from influxdb_client import InfluxDBClient
 from influxdb_client.client.write_api import WriteApi, WriteOptions
+from influxdb_client.domain.write_precision import WritePrecision
 import serial
 import serial.tools.list_ports
 import requests
+from requests.adapters import HTTPAdapter
 import openai
 
+try:
+    import orjson  # type: ignore
+except Exception:
+    orjson = None
+
 try:
     import RPi.GPIO as GPIO  # type: ignore
 except Exception:
@@ -38,6 +49,15 @@ except Exception:
 
 BAUDRATE = 115200
 HANDSHAKE_TIMEOUT = 4.0
+SERIAL_READ_TIMEOUT = 0.2
+SERIAL_WRITE_TIMEOUT = 0.5
+BOOT_BANNER_TIMEOUT = 2.5
+# Taille du tampon N_TTY du noyau : un seul os.read() vide tout ce qui est reçu
+SERIAL_RX_CHUNK_SIZE = 4096
+# Commandes périodiques pré-encodées (évite strip/concat/encode à chaque envoi)
+PRE_ENCODED_COMMANDS = {
+    cmd: (cmd + "\r\n").encode() for cmd in ("HELLO?", "STATUS?", "TEMP?", "MTR OFF")
+}
 BASE_DIR = Path(__file__).resolve().parent
 PUMP_CONFIG_PATH = BASE_DIR / "pump_config.json"
 LIGHT_SCHEDULE_PATH = BASE_DIR / "light_schedule.json"
@@ -47,11 +67,16 @@ PERISTALTIC_SCHEDULE_PATH = BASE_DIR / "peristaltic_schedule.json"
 PERISTALTIC_LAST_RUNS_PATH = BASE_DIR / "peristaltic_last_runs.json"
 CONTROL_FILE_PATH = BASE_DIR / "control.txt"
 VALUES_POST_PERIOD = 10.0
+# Échéances mesurées avec time.monotonic() ; "jamais" doit précéder toute valeur
+# (l'horloge monotone part de zéro au démarrage du Pi)
+NEVER = float("-inf")
 REQUEST_TIMEOUT = 3.0
-VALUES_LOG_PATH = BASE_DIR / "telemetry_values.log"
-EVENTS_LOG_PATH = BASE_DIR / "telemetry_events.log"
-INFLUX_LOG_PATH = BASE_DIR / "telemetry_influx.log"
-SERIAL_LOG_PATH = BASE_DIR / "telemetry_serial.log"
+# Répertoire des journaux de télémétrie (REEF_LOG_DIR pour l'écarter du code)
+LOG_DIR = Path(os.environ.get("REEF_LOG_DIR") or BASE_DIR)
+VALUES_LOG_PATH = LOG_DIR / "telemetry_values.log"
+EVENTS_LOG_PATH = LOG_DIR / "telemetry_events.log"
+INFLUX_LOG_PATH = LOG_DIR / "telemetry_influx.log"
+SERIAL_LOG_PATH = LOG_DIR / "telemetry_serial.log"
 PH_CALIBRATION_PATH = BASE_DIR / "ph_calibration.json"
 PH_CALIB_REFERENCES = {"4.01": 4.01, "6.86": 6.86, "9.18": 9.18}
 DEFAULT_PH_SLOPE = -1.0 / 0.18  # approx -5.5556 pH/V
@@ -59,6 +84,8 @@ DEFAULT_PH_OFFSET = 7.0 + 2.5 / 0.18  # approx 20.8889 at 0 V
 PUMP_GPIO_PIN = 22
 FAN_GPIO_PIN = 23
 HEAT_GPIO_PIN = 24  # relais chauffe eau
+# Réécriture périodique du relais de chauffe même sans changement d'état (s)
+HEAT_GPIO_REFRESH_PERIOD = 60.0
 TEMP_NAMES_PATH = Path("temp_names.json")
 LIGHT_GPIO_PIN = 27
 LIGHT_QUERY_PERIOD = 6.0
@@ -72,10 +99,73 @@ LIGHT_DAY_KEYS = [
     "saturday",
     "sunday",
 ]
+# Délai de regroupement des sauvegardes de configuration (rafales de réglages)
+CONFIG_SAVE_DELAY = 0.5
+# Resynchronisation maximale du planificateur d'éclairage entre deux transitions
+LIGHT_SCHEDULER_MAX_SLEEP = 300.0
 OPENAI_KEY_FILE_PATH = BASE_DIR / ".openai_api_key"
 PERISTALTIC_STEPS_PER_ML = 5000
 DEFAULT_FEEDER_STOP_PUMP = False
 DEFAULT_FEEDER_PUMP_STOP_DURATION_MIN = 5
+# "T_WATER:25.3|T_AIR:24.1|...": clé puis valeur jusqu'au prochain "|" (suffixe C ignoré)
+TEMP_FIELD_RE = re.compile(r"(\w+):\s*([^|C]*)")
+# "LEVEL LOW=OK|HIGH=LOW|ALERT=0" : paires clé=valeur séparées par espaces ou "|"
+LEVEL_FIELD_RE = re.compile(r"([^\s|=]+)=([^\s|]*)")
+# Préfixe d'une ligne Mega ("STATUS;...", "T_WATER:...", "LEVEL LOW=...", "ERR|...")
+LINE_TAG_RE = re.compile(r"[A-Z_]+")
+
+
+def _dumps_config(data: Any) -> bytes:
+    """JSON indenté des fichiers de configuration (orjson si disponible)."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    return json.dumps(data, indent=2).encode("utf-8")
+
+
+def _loads_config(path: Path) -> Any:
+    data = path.read_bytes()
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _write_json_atomic(path: Path, data: bytes) -> None:
+    """Écrit via un fichier temporaire + os.replace (jamais de JSON tronqué).
+
+    Temporaire propre au thread : deux écrivains du même fichier ne partagent pas le
+    .tmp (droits par défaut conservés, contrairement à tempfile).
+    """
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def _int_from_float(value: str) -> int:
+    return int(float(value))
+
+
+# Entrées STATUS recopiées telles quelles dans l'état : clé -> (clé d'état, parseur)
+STATUS_FIELD_PARSERS: Dict[str, tuple[str, Callable[[str], Any]]] = {
+    "auto_thresh": ("auto_thresh", float),
+    "pidw_tgt": ("tset_water", float),
+    "pidr_tgt": ("tset_res", float),
+    "ph_raw": ("ph_raw", _int_from_float),
+    "servo": ("servo_angle", _int_from_float),
+    "level_low": ("lvl_low", str),
+    "level_high": ("lvl_high", str),
+    "level_alert": ("lvl_alert", str),
+}
+STATUS_TEMP_KEYS = {
+    "tempw": "temp_1",
+    "tempa": "temp_3",
+    "tempymin": "temp_4",
+    "tempymax": "temp_2",
+}
+STATUS_AXIS_KEYS = {"mtrx": "X", "mtry": "Y", "mtrz": "Z", "mtre": "E"}
 
 logger = logging.getLogger("reef.controller")
 logger.setLevel(logging.INFO)
@@ -85,18 +175,42 @@ if not logger.handlers:
     logger.addHandler(handler)
 
 
+# Les journaux de télémétrie passent par une file : l'écriture disque (et la
+# rotation) est faite par un seul thread QueueListener, hors des threads appelants
+_file_log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+_file_log_handlers: list[logging.Handler] = []
+# Taille du fichier vérifiée toutes les N lignes seulement (seek/tell par ligne sinon)
+LOG_ROLLOVER_CHECK_EVERY = 1024
+
+
+class SampledRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """RotatingFileHandler qui ne teste maxBytes qu'une ligne sur N."""
+
+    _records_since_check = 0
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        self._records_since_check += 1
+        if self._records_since_check < LOG_ROLLOVER_CHECK_EVERY:
+            return False
+        self._records_since_check = 0
+        return bool(super().shouldRollover(record))
+
+
 def _build_rotating_file_logger(name: str, path: str) -> logging.Logger:
     lgr = logging.getLogger(name)
     lgr.setLevel(logging.INFO)
     if not lgr.handlers:
         Path(path).parent.mkdir(parents=True, exist_ok=True)
-        handler = logging.handlers.RotatingFileHandler(
+        handler = SampledRotatingFileHandler(
             path, maxBytes=50 * 1024 * 1024, backupCount=1, encoding="utf-8"
         )
         handler.setFormatter(
             logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
         )
-        lgr.addHandler(handler)
+        # Le listener est partagé : chaque fichier ne garde que les lignes de son logger
+        handler.addFilter(logging.Filter(name))
+        _file_log_handlers.append(handler)
+        lgr.addHandler(logging.handlers.QueueHandler(_file_log_queue))
         lgr.propagate = False
     return lgr
 
@@ -113,6 +227,11 @@ telemetry_influx_logger = _build_rotating_file_logger(
 serial_exchange_logger = _build_rotating_file_logger(
     "reef.telemetry.serial", SERIAL_LOG_PATH
 )
+_file_log_listener = logging.handlers.QueueListener(
+    _file_log_queue, *_file_log_handlers, respect_handler_level=True
+)
+_file_log_listener.start()
+atexit.register(_file_log_listener.stop)
 
 
 INFLUXDB_URL = os.environ.get("INFLUXDB_URL")
@@ -121,6 +240,77 @@ INFLUXDB_ORG = os.environ.get("INFLUXDB_ORG")
 INFLUXDB_BUCKET = os.environ.get("INFLUXDB_BUCKET")
 INFLUXDB_MEASUREMENT = os.environ.get("INFLUXDB_MEASUREMENT", "reef_controller")
 
+# Échappements du line protocol InfluxDB (identiques à influxdb_client.Point)
+_LP_ESCAPE_MEASUREMENT = str.maketrans(
+    {",": r"\,", " ": r"\ ", "\n": r"\n", "\t": r"\t", "\r": r"\r"}
+)
+_LP_ESCAPE_KEY = str.maketrans(
+    {",": r"\,", "=": r"\=", " ": r"\ ", "\n": r"\n", "\t": r"\t", "\r": r"\r"}
+)
+_LP_ESCAPE_STRING = str.maketrans({'"': r'\"', "\\": r"\\"})
+
+
+def _lp_tag_value(value: Any) -> str:
+    escaped = str(value).translate(_LP_ESCAPE_KEY)
+    return escaped + " " if escaped.endswith("\\") else escaped
+
+
+@lru_cache(maxsize=256)
+def _lp_prefix(measurement: str, tags: tuple[tuple[Any, str], ...]) -> str:
+    """Préfixe `measurement,tag=valeur,...` ; tags déjà triés par clé."""
+    parts = [measurement.translate(_LP_ESCAPE_MEASUREMENT)]
+    for key, value in tags:
+        tag_key = str(key).translate(_LP_ESCAPE_KEY)
+        tag_value = _lp_tag_value(value)
+        if tag_key and tag_value:
+            parts.append(f"{tag_key}={tag_value}")
+    return ",".join(parts)
+
+
+def _lp_float(value: float) -> Optional[str]:
+    if not math.isfinite(value):
+        return None
+    text = str(value)
+    return text[:-2] if text.endswith(".0") else text
+
+
+def _lp_str(value: str) -> Optional[str]:
+    # Une chaîne numérique est envoyée comme float, sinon comme chaîne
+    try:
+        return _lp_float(float(value))
+    except ValueError:
+        return f'"{value.translate(_LP_ESCAPE_STRING)}"'
+
+
+# Formatage des valeurs de champ par type exact (un seul lookup par champ)
+_LP_FIELD_FORMATTERS: Dict[type, Callable[[Any], Optional[str]]] = {
+    bool: lambda value: "true" if value else "false",
+    int: lambda value: f"{value}i",
+    float: _lp_float,
+    str: _lp_str,
+    type(None): lambda value: None,
+}
+
+
+def _lp_field_value(value: Any) -> Optional[str]:
+    formatter = _LP_FIELD_FORMATTERS.get(type(value))
+    if formatter is not None:
+        return formatter(value)
+    # Sous-classes et autres types : conversion générique
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return f"{value}i"
+    if isinstance(value, float):
+        return _lp_float(value)
+    try:
+        return _lp_float(float(value))
+    except (TypeError, ValueError):
+        try:
+            return f'"{str(value).translate(_LP_ESCAPE_STRING)}"'
+        except Exception:
+            return None
+
 
 class TelemetryPublisher:
     def __init__(self) -> None:
@@ -169,23 +359,36 @@ class TelemetryPublisher:
         if not all([measurement, tags, fields, self._write_api, self.bucket, self.org]):
             return
 
-        point = Point(measurement)
-        for key, value in tags.items():
-            if value is not None:
-                point.tag(str(key), str(value))
-
-        valid_fields = False
-        for key, value in fields.items():
-            coerced_value = self._coerce_field_value(value)
-            if coerced_value is not None:
-                point.field(str(key), coerced_value)
-                valid_fields = True
+        # Ligne construite directement (pas d'objet Point) ; le WriteApi en mode
+        # batching la met en file et l'envoie avec les autres (WriteOptions)
+        prefix = _lp_prefix(
+            measurement,
+            tuple(
+                sorted(
+                    (key, str(value)) for key, value in tags.items() if value is not None
+                )
+            ),
+        )
+        field_parts = []
+        for key, value in sorted(fields.items()):
+            text = _lp_field_value(value)
+            if text is not None:
+                field_parts.append(f"{str(key).translate(_LP_ESCAPE_KEY)}={text}")
 
-        if not valid_fields:
+        if not field_parts:
             return
 
+        # Horodatage à la seconde côté client : sans lui, InfluxDB date les
+        # points à la réception du lot (jusqu'à flush_interval de retard)
+        line = f"{prefix} {','.join(field_parts)} {int(time.time())}"
+
         try:
-            self._write_api.write(bucket=self.bucket, org=self.org, record=point)
+            self._write_api.write(
+                bucket=self.bucket,
+                org=self.org,
+                record=line,
+                write_precision=WritePrecision.S,
+            )
             telemetry_influx_logger.info(
                 "INFLUX measurement=%s tags=%s fields=%s",
                 measurement,
@@ -201,26 +404,6 @@ class TelemetryPublisher:
                 exc,
             )
 
-    @staticmethod
-    def _coerce_field_value(
-        value: Any,
-    ) -> Optional[Union[float, int, bool, str]]:
-        if value is None:
-            return None
-        if isinstance(value, bool):
-            return value
-        if isinstance(value, int):
-            return value
-        if isinstance(value, float):
-            return value
-        try:
-            return float(value)
-        except (TypeError, ValueError):
-            try:
-                return str(value)
-            except Exception:
-                return None
-
 
 telemetry_publisher = TelemetryPublisher()
 
@@ -259,15 +442,35 @@ class SerialClient:
         self._ser: Optional[serial.Serial] = None
         self._reader: Optional[threading.Thread] = None
         self._stop = threading.Event()
+        # Sérialise les écritures (threads API/planificateurs) et la fermeture du port
+        self._ser_lock = threading.Lock()
+        # Pipe de réveil : close() interrompt le select() du lecteur sans timeout ;
+        # créé par open() avec le lecteur, refermé par close()
+        self._wake_r: Optional[int] = None
+        self._wake_w: Optional[int] = None
         self._line_handler = line_handler
         self.port: Optional[str] = None
 
     def open(self, port: str) -> tuple[str, str]:
         self.close()
         self.port = port
-        self._ser = serial.Serial(port, BAUDRATE, timeout=0.2)
-        time.sleep(1.5)
+        self._ser = serial.Serial(
+            port,
+            BAUDRATE,
+            timeout=SERIAL_READ_TIMEOUT,
+            write_timeout=SERIAL_WRITE_TIMEOUT,
+            exclusive=True,
+        )
+        # Linux : désactive la temporisation des UART / adaptateurs USB-série (16 ms par
+        # défaut sur FTDI). Le driver cdc_acm (/dev/ttyACM*, la Mega en USB natif) n'a
+        # pas de latency timer et refuse TIOCSSERIAL : rien à gagner, pas d'appel.
+        if not os.path.basename(port).startswith("ttyACM"):
+            try:
+                self._ser.set_low_latency_mode(True)
+            except (AttributeError, OSError, ValueError) as exc:
+                logger.debug("[SER] low latency mode unavailable: %s", exc)
         try:
+            self._wait_for_boot()
             hello_line = self._handshake(
                 "HELLO?", lambda l: l.startswith("HELLO OK"), "HELLO"
             )
@@ -278,18 +481,33 @@ class SerialClient:
             self.close()
             raise
         self._stop.clear()
+        self._wake_r, self._wake_w = os.pipe()
         self._reader = threading.Thread(target=self._reader_loop, daemon=True)
         self._reader.start()
         return hello_line, status_line
 
+    def _wait_for_boot(self) -> None:
+        """Attend la bannière BOOTING de la Mega (reset à l'ouverture du port)."""
+        assert self._ser is not None
+        deadline = time.monotonic() + BOOT_BANNER_TIMEOUT
+        while time.monotonic() < deadline:
+            line = self._ser.read_until(b"\n").decode(errors="ignore").strip()
+            if not line:
+                continue
+            serial_exchange_logger.info("<< %s", line)
+            if line.startswith("BOOTING"):
+                return
+        logger.debug("[SER] no boot banner, proceeding with handshake")
+
     def _handshake(
         self, command: str, predicate: Callable[[str], bool], label: str
     ) -> str:
         assert self._ser is not None
-        deadline = time.time() + HANDSHAKE_TIMEOUT
+        deadline = time.monotonic() + HANDSHAKE_TIMEOUT
         self._write(command)
-        while time.time() < deadline:
-            line = self._ser.readline().decode(errors="ignore").strip()
+        self._ser.flush()
+        while time.monotonic() < deadline:
+            line = self._ser.read_until(b"\n").decode(errors="ignore").strip()
             if not line:
                 continue
             serial_exchange_logger.info("<< %s", line)
@@ -299,41 +517,88 @@ class SerialClient:
         raise RuntimeError(f"Timeout {label}")
 
     def _write(self, command: str) -> None:
-        if not self._ser:
-            raise RuntimeError("Port fermé")
-        payload = (command.strip() + "\r\n").encode()
-        serial_exchange_logger.info(">> %s", command.strip())
-        self._ser.write(payload)
-        self._ser.flush()
+        payload = PRE_ENCODED_COMMANDS.get(command)
+        if payload is None:
+            command = command.strip()
+            payload = (command + "\r\n").encode()
+        with self._ser_lock:
+            if not self._ser:
+                raise RuntimeError("Port fermé")
+            serial_exchange_logger.info(">> %s", command)
+            # write() rend la main une fois les octets dans le tampon noyau : pas de
+            # tcdrain() par commande, la réponse OK/ERR sert d'accusé de réception
+            self._ser.write(payload)
 
     def write(self, command: str) -> None:
         self._write(command)
 
     def close(self) -> None:
         self._stop.set()
-        if self._reader and self._reader.is_alive():
-            self._reader.join(timeout=0.5)
-        self._reader = None
-        if self._ser:
+        if self._wake_w is not None:
+            try:
+                os.write(self._wake_w, b"\0")
+            except OSError:
+                pass
+        if self._ser and hasattr(self._ser, "cancel_read"):
             try:
-                self._ser.close()
+                self._ser.cancel_read()  # débloque ser.read() (chemin sans select)
             except Exception:
                 pass
-        self._ser = None
+        if self._reader and self._reader.is_alive():
+            self._reader.join(timeout=0.5)
+        self._reader = None
+        # Lecteur arrêté : plus personne n'attend sur le pipe (sinon fuite de 2 fd
+        # à chaque reconnexion) ; un second close() n'a plus rien à fermer
+        for wake_fd in (self._wake_r, self._wake_w):
+            if wake_fd is not None:
+                try:
+                    os.close(wake_fd)
+                except OSError:
+                    pass
+        self._wake_r = self._wake_w = None
+        with self._ser_lock:
+            if self._ser:
+                try:
+                    self._ser.close()
+                except Exception:
+                    pass
+            self._ser = None
         self.port = None
 
     def _reader_loop(self) -> None:
-        assert self._ser is not None
+        assert self._ser is not None and self._wake_r is not None
+        ser = self._ser
+        wake_r = self._wake_r
+        try:
+            fd: Optional[int] = ser.fileno()
+        except Exception:
+            fd = None  # pas de descripteur sélectionnable (Windows)
+        buf = bytearray()
         while not self._stop.is_set():
             try:
-                line = self._ser.readline()
-                if not line:
-                    continue
-                decoded = line.decode(errors="ignore").strip()
-                if not decoded:
-                    continue
-                serial_exchange_logger.info("<< %s", decoded)
-                self._line_handler(decoded)
+                if fd is not None:
+                    ready, _, _ = select.select([fd, wake_r], [], [])
+                    if wake_r in ready:
+                        os.read(wake_r, 64)
+                        continue
+                    chunk = os.read(fd, SERIAL_RX_CHUNK_SIZE)
+                    if not chunk:
+                        raise serial.SerialException(
+                            "port prêt mais aucune donnée (déconnecté ?)"
+                        )
+                else:
+                    # Bloque jusqu'au premier octet puis vide tout ce qui est déjà reçu
+                    chunk = ser.read(max(1, ser.in_waiting))
+                    if not chunk:
+                        continue
+                buf.extend(chunk)
+                while (idx := buf.find(b"\n")) >= 0:
+                    decoded = buf[:idx].decode(errors="ignore").strip()
+                    del buf[: idx + 1]
+                    if not decoded:
+                        continue
+                    serial_exchange_logger.info("<< %s", decoded)
+                    self._line_handler(decoded)
             except Exception as exc:
                 logger.error("[SER] reader error: %s", exc)
                 self._stop.set()
@@ -349,7 +614,25 @@ class ReefController:
         self.connected = False
         self.status_text = "Déconnecté"
         self.last_error: Optional[Dict[str, Any]] = None
-        self.response_queue: queue.Queue[tuple[str, Any]] = queue.Queue()
+        # Une seule commande en vol : la réponse OK/ERR est déposée dans un slot
+        self._resp_event = threading.Event()
+        self._resp_slot: Optional[tuple[str, Any]] = None
+        self._cmd_lock = threading.Lock()
+        self._line_handlers: Dict[str, Callable[[str], None]] = {
+            "ERR": self._apply_error_line,
+            "HELLO": self._apply_hello_line,
+            "STATUS": self._apply_status_reply,
+            "T_WATER": self._apply_temp_line,
+            "LEVEL": self._apply_level_line,
+        }
+        # Entrées STATUS à effets de bord (événements, repli, conversion pH)
+        self._status_key_handlers: Dict[str, Callable[[str, str], None]] = {
+            "mtr": self._apply_status_motor_power,
+            "fan_val": self._apply_status_fan,
+            "ph_v": self._apply_status_ph_voltage,
+            **dict.fromkeys(STATUS_TEMP_KEYS, self._apply_status_temp),
+            **dict.fromkeys(STATUS_AXIS_KEYS, self._apply_status_axis),
+        }
         self.state_lock = threading.RLock()
         self.state: Dict[str, Any] = {
             "temp_1": "--.-",
@@ -418,15 +701,31 @@ class ReefController:
         }
         self._load_ph_calibration()
         self._openai_api_key: Optional[str] = None
+        # Session partagée pour les webhooks du nourrisseur (connexions keep-alive)
+        self._http = requests.Session()
+        feeder_adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4)
+        self._http.mount("http://", feeder_adapter)
+        self._http.mount("https://", feeder_adapter)
         self.global_speed = 400
         self.steps_per_job = 1000
         self._light_sensor: Optional[LightSensorTSL2591] = None
-        self._last_light_query = 0.0
+        self._last_light_query = NEVER
+        # Horaires d'éclairage convertis en minutes depuis minuit (jour -> (on, off))
+        self._light_minutes: Dict[str, tuple[int, int]] = {}
+        self._light_wakeup = threading.Event()
+        # Fichiers de configuration à réécrire, vidés par le thread _persist_loop
+        self._dirty_configs: set[str] = set()
+        self._dirty_configs_lock = threading.Lock()
+        self._persist_wakeup = threading.Event()
+        # Sérialise les vidages (thread de persistance, atexit, SIGTERM)
+        self._persist_lock = threading.Lock()
+        # Échéance (time.monotonic) du MTR OFF automatique, servie par _motor_off_loop
+        self._motor_off_deadline: Optional[float] = None
+        self._motor_off_cond = threading.Condition()
         self._load_configs()
         self._ensure_pump_defaults()
         self._ensure_light_schedule_defaults()
         self._load_heat_config()
-        self._load_temp_names()
         self._load_feeder_config()
         self._load_peristaltic_schedule()
         self._ensure_peristaltic_schedule_defaults()
@@ -439,6 +738,9 @@ class ReefController:
         self.pump_gpio_ready = False
         self.fan_gpio_ready = False
         self.heat_gpio_ready = False
+        # Dernier état écrit sur le relais de chauffe (None : inconnu)
+        self._heat_gpio_state: Optional[bool] = None
+        self._heat_gpio_written_at = 0.0  # time.monotonic() de la dernière écriture
         self.level_gpio_ready = False
         self._init_light_gpio()
         self._init_pump_gpio()
@@ -449,11 +751,13 @@ class ReefController:
         self._drive_fan_gpio(self.state.get("fan", 0) > 0)
         self._drive_heat_gpio(self.state.get("heat_enabled", False))
         self._update_high_level_state()
-        self._last_temp_query = 0.0
-        self._last_level_query = 0.0
-        self._last_status_query = 0.0
-        self._last_values_push = 0.0
-        self._last_auto_connect_attempt = 0.0
+        self._last_temp_query = NEVER
+        self._last_level_query = NEVER
+        self._last_status_query = NEVER
+        self._last_values_push = NEVER
+        self._last_auto_connect_attempt = NEVER
+        self._telemetry_wakeup = threading.Event()
+        self._last_heat_inputs: Optional[tuple[str, str]] = None
         self._last_feeder_runs: Dict[str, float] = {}
         self._last_peristaltic_runs: Dict[str, float] = {}
         if HAS_TSL2591:
@@ -463,6 +767,12 @@ class ReefController:
             except Exception as exc:
                 self._light_sensor = None
                 logger.warning("Impossible d'initialiser le capteur TSL2591: %s", exc)
+        self.persist_thread = threading.Thread(target=self._persist_loop, daemon=True)
+        self.persist_thread.start()
+        self.motor_off_thread = threading.Thread(
+            target=self._motor_off_loop, daemon=True
+        )
+        self.motor_off_thread.start()
         self.light_scheduler = threading.Thread(
             target=self._light_scheduler_loop, daemon=True
         )
@@ -485,9 +795,7 @@ class ReefController:
     def _load_configs(self) -> None:
         if PUMP_CONFIG_PATH.exists():
             try:
-                self.state["pump_config"] = json.loads(
-                    PUMP_CONFIG_PATH.read_text("utf-8")
-                )
+                self.state["pump_config"] = _loads_config(PUMP_CONFIG_PATH)
             except Exception:
                 self.state["pump_config"] = {}
         else:
@@ -495,9 +803,7 @@ class ReefController:
 
         if LIGHT_SCHEDULE_PATH.exists():
             try:
-                self.state["light_schedule"] = json.loads(
-                    LIGHT_SCHEDULE_PATH.read_text("utf-8")
-                )
+                self.state["light_schedule"] = _loads_config(LIGHT_SCHEDULE_PATH)
             except Exception:
                 pass
         self._load_temp_names()
@@ -506,43 +812,82 @@ class ReefController:
             self.state["auto_fan"] = True
             self.state["fan_on"] = False
 
+    def _schedule_save(self, name: str) -> None:
+        """Sauvegarde différée : l'écriture disque se fait hors du thread appelant."""
+        with self._dirty_configs_lock:
+            self._dirty_configs.add(name)
+        self._persist_wakeup.set()
+
+    def _persist_loop(self) -> None:
+        while True:
+            self._persist_wakeup.wait()
+            # Laisse une rafale de réglages se terminer avant d'écrire une seule fois
+            time.sleep(CONFIG_SAVE_DELAY)
+            self._persist_wakeup.clear()
+            self.flush_pending_saves()
+
+    def flush_pending_saves(self) -> None:
+        # Un vidage concurrent attend la fin de celui en cours (fichiers complets)
+        with self._persist_lock:
+            with self._dirty_configs_lock:
+                dirty, self._dirty_configs = self._dirty_configs, set()
+            writers = {
+                "pump": self._write_pump_config,
+                "temp_names": self._write_temp_names,
+                "feeder": self._write_feeder_config,
+                "peristaltic_schedule": self._write_peristaltic_schedule,
+            }
+            for name in dirty:
+                writers[name]()
+
     def _save_pump_config(self) -> None:
+        self._schedule_save("pump")
+
+    def _write_pump_config(self) -> None:
         try:
-            PUMP_CONFIG_PATH.write_text(
-                json.dumps(self.state["pump_config"], indent=2), encoding="utf-8"
-            )
+            with self.state_lock:
+                data = _dumps_config(self.state["pump_config"])
+            _write_json_atomic(PUMP_CONFIG_PATH, data)
         except Exception as exc:
             logger.error("Unable to save pump config: %s", exc)
 
     def _save_light_schedule(self) -> None:
+        # Réglage rare mais critique : écrit tout de suite, sans délai de regroupement
+        with self._persist_lock:
+            self._write_light_schedule()
+
+    def _write_light_schedule(self) -> None:
         try:
-            LIGHT_SCHEDULE_PATH.write_text(
-                json.dumps(self.state["light_schedule"], indent=2), encoding="utf-8"
-            )
+            with self.state_lock:
+                data = _dumps_config(self.state["light_schedule"])
+            _write_json_atomic(LIGHT_SCHEDULE_PATH, data)
         except Exception as exc:
             logger.error("Unable to save light schedule: %s", exc)
 
     def _load_temp_names(self) -> None:
         if TEMP_NAMES_PATH.exists():
             try:
-                data = json.loads(TEMP_NAMES_PATH.read_text("utf-8"))
+                data = _loads_config(TEMP_NAMES_PATH)
                 if isinstance(data, dict):
                     self.state.setdefault("temp_names", {}).update(data)
             except Exception:
                 pass
 
     def _save_temp_names(self) -> None:
+        self._schedule_save("temp_names")
+
+    def _write_temp_names(self) -> None:
         try:
-            TEMP_NAMES_PATH.write_text(
-                json.dumps(self.state.get("temp_names", {}), indent=2), encoding="utf-8"
-            )
+            with self.state_lock:
+                data = _dumps_config(self.state.get("temp_names", {}))
+            _write_json_atomic(TEMP_NAMES_PATH, data)
         except Exception as exc:
             logger.error("Unable to save temp names: %s", exc)
 
     def _load_feeder_config(self) -> None:
         if FEEDER_CONFIG_PATH.exists():
             try:
-                data = json.loads(FEEDER_CONFIG_PATH.read_text("utf-8"))
+                data = _loads_config(FEEDER_CONFIG_PATH)
                 if isinstance(data, dict):
                     if isinstance(data.get("schedule"), list):
                         # Enrich with default method if absent to keep compat
@@ -584,6 +929,9 @@ class ReefController:
                 logger.error("Unable to load feeder config: %s", exc)
 
     def _save_feeder_config(self) -> None:
+        self._schedule_save("feeder")
+
+    def _write_feeder_config(self) -> None:
         with self.state_lock:
             auto = bool(self.state.get("feeder_auto", True))
             existing_schedule = list(self.state.get("feeder_schedule", []))
@@ -613,15 +961,9 @@ class ReefController:
                 }
             )
         try:
-            FEEDER_CONFIG_PATH.write_text(
-                json.dumps(
-                    {
-                        "auto": auto,
-                        "schedule": schedule,
-                    },
-                    indent=2,
-                ),
-                encoding="utf-8",
+            _write_json_atomic(
+                FEEDER_CONFIG_PATH,
+                _dumps_config({"auto": auto, "schedule": schedule}),
             )
         except Exception as exc:
             logger.error("Unable to save feeder config: %s", exc)
@@ -657,7 +999,7 @@ class ReefController:
         if not PERISTALTIC_SCHEDULE_PATH.exists():
             return
         try:
-            data = json.loads(PERISTALTIC_SCHEDULE_PATH.read_text("utf-8"))
+            data = _loads_config(PERISTALTIC_SCHEDULE_PATH)
         except Exception as exc:
             logger.error("Unable to load peristaltic schedule: %s", exc)
             return
@@ -679,15 +1021,17 @@ class ReefController:
         self.state["peristaltic_schedule"] = schedule
 
     def _save_peristaltic_schedule(self) -> None:
+        self._schedule_save("peristaltic_schedule")
+
+    def _write_peristaltic_schedule(self) -> None:
         with self.state_lock:
             payload = {
                 "auto": self.state.get("peristaltic_auto", True),
                 "schedule": self.state.get("peristaltic_schedule", {}),
             }
+            data = _dumps_config(payload)
         try:
-            PERISTALTIC_SCHEDULE_PATH.write_text(
-                json.dumps(payload, indent=2), encoding="utf-8"
-            )
+            _write_json_atomic(PERISTALTIC_SCHEDULE_PATH, data)
         except Exception as exc:
             logger.error("Unable to save peristaltic schedule: %s", exc)
 
@@ -737,7 +1081,7 @@ class ReefController:
         if not PERISTALTIC_LAST_RUNS_PATH.exists():
             return
         try:
-            data = json.loads(PERISTALTIC_LAST_RUNS_PATH.read_text("utf-8"))
+            data = _loads_config(PERISTALTIC_LAST_RUNS_PATH)
         except Exception as exc:
             logger.error("Unable to load peristaltic last runs: %s", exc)
             return
@@ -760,15 +1104,20 @@ class ReefController:
                 self._peristaltic_last_runs[axis] = normalized_history
 
     def _save_peristaltic_last_runs(self) -> None:
+        # Écrit tout de suite : perdre l'historique après un arrêt brutal
+        # redéclencherait une dose déjà faite
+        with self._persist_lock:
+            self._write_peristaltic_last_runs()
+
+    def _write_peristaltic_last_runs(self) -> None:
         with self._peristaltic_runs_lock:
             payload = {
                 axis: list(self._peristaltic_last_runs.get(axis, []))
                 for axis in ("X", "Y", "Z", "E")
             }
+            data = _dumps_config(payload)
         try:
-            PERISTALTIC_LAST_RUNS_PATH.write_text(
-                json.dumps(payload, indent=2), encoding="utf-8"
-            )
+            _write_json_atomic(PERISTALTIC_LAST_RUNS_PATH, data)
         except Exception as exc:
             logger.error("Unable to save peristaltic last runs: %s", exc)
 
@@ -824,7 +1173,7 @@ class ReefController:
     def _load_heat_config(self) -> None:
         if HEAT_CONFIG_PATH.exists():
             try:
-                data = json.loads(HEAT_CONFIG_PATH.read_text("utf-8"))
+                data = _loads_config(HEAT_CONFIG_PATH)
                 with self.state_lock:
                     if "targets" in data:
                         t = data["targets"]
@@ -860,6 +1209,11 @@ class ReefController:
                 logger.error("Unable to read heat config: %s", exc)
 
     def _save_heat_config(self) -> None:
+        # Réglage rare mais critique : écrit tout de suite, sans délai de regroupement
+        with self._persist_lock:
+            self._write_heat_config()
+
+    def _write_heat_config(self) -> None:
         with self.state_lock:
             payload = {
                 "targets": self.state.get("heat_targets", {}),
@@ -868,8 +1222,9 @@ class ReefController:
                 "state": self.state.get("heat_state", {}),
                 "hyst": self.state.get("heat_hyst", 0.3),
             }
+            data = _dumps_config(payload)
         try:
-            HEAT_CONFIG_PATH.write_text(json.dumps(payload, indent=2), encoding="utf-8")
+            _write_json_atomic(HEAT_CONFIG_PATH, data)
         except Exception as exc:
             logger.error("Unable to save heat config: %s", exc)
 
@@ -909,6 +1264,28 @@ class ReefController:
                 sched.pop("weekend", None)
             for day in LIGHT_DAY_KEYS:
                 sched.setdefault(day, {"on": "08:00", "off": "20:00"})
+            self._refresh_light_minutes()
+
+    def _refresh_light_minutes(self) -> None:
+        """À appeler sous state_lock après toute modification de light_schedule."""
+
+        def to_minutes(val: Any) -> Optional[int]:
+            try:
+                hh, mm = val.split(":", 1)
+                return int(hh) * 60 + int(mm)
+            except Exception:
+                return None
+
+        minutes: Dict[str, tuple[int, int]] = {}
+        for day, zone in self.state.get("light_schedule", {}).items():
+            if not isinstance(zone, dict):
+                continue
+            on_min = to_minutes(zone.get("on"))
+            off_min = to_minutes(zone.get("off"))
+            if on_min is not None and off_min is not None:
+                minutes[day] = (on_min, off_min)
+        self._light_minutes = minutes
+        self._light_wakeup.set()
 
     def _pause_requested(self) -> bool:
         try:
@@ -979,11 +1356,20 @@ class ReefController:
     def _drive_heat_gpio(self, enabled: bool) -> None:
         if not self.heat_gpio_ready or GPIO is None:
             return
+        now = time.monotonic()
+        if (
+            enabled == self._heat_gpio_state
+            and now - self._heat_gpio_written_at < HEAT_GPIO_REFRESH_PERIOD
+        ):
+            return  # relais déjà dans cet état, réaffirmé récemment
         try:
             GPIO.output(HEAT_GPIO_PIN, GPIO.LOW if enabled else GPIO.HIGH)
+            self._heat_gpio_state = enabled
+            self._heat_gpio_written_at = now
         except Exception as exc:
             logger.error("Heat relay write failed: %s", exc)
             self.heat_gpio_ready = False
+            self._heat_gpio_state = None
 
     def _init_fan_gpio(self) -> None:
         if GPIO is None:
@@ -1214,11 +1600,15 @@ class ReefController:
 
     def _light_scheduler_loop(self) -> None:
         while True:
+            # Effacé avant la passe : un changement signalé pendant celle-ci n'est pas perdu
+            self._light_wakeup.clear()
+            delay = LIGHT_SCHEDULER_MAX_SLEEP
             try:
-                self._tick_light_schedule()
+                delay = min(delay, self._tick_light_schedule())
             except Exception as exc:
                 logger.error("Light scheduler error: %s", exc)
-            time.sleep(30)
+            # Réveil à la prochaine transition ou dès que l'horaire / le mode auto change
+            self._light_wakeup.wait(max(1.0, delay))
 
     def _telemetry_loop(self) -> None:
         while True:
@@ -1226,7 +1616,7 @@ class ReefController:
                 if self._pause_requested():
                     time.sleep(1.0)
                     continue
-                now = time.time()
+                now = time.monotonic()
                 if self.connected:
                     if now - self._last_temp_query > 2.0:
                         self._last_temp_query = now
@@ -1262,11 +1652,27 @@ class ReefController:
                             self.state["light_lux"] = lux
                     except Exception as exc:
                         logger.debug("Lecture TSL2591 échouée: %s", exc)
-                time.sleep(1.0)
+                # Dormir jusqu'à la prochaine échéance utile (connect() réveille la boucle)
+                delay = self._next_telemetry_deadline() - time.monotonic()
+                self._telemetry_wakeup.wait(max(delay, 0.1))
+                self._telemetry_wakeup.clear()
             except Exception as exc:
                 logger.error("Telemetry loop error: %s", exc)
                 time.sleep(2.0)
 
+    def _next_telemetry_deadline(self) -> float:
+        deadlines = [self._last_values_push + VALUES_POST_PERIOD]
+        if self.connected:
+            # _evaluate_fan tourne à chaque passage tant que la Mega est connectée
+            deadlines.append(time.monotonic() + 1.0)
+        else:
+            deadlines.append(self._last_auto_connect_attempt + 10.0)
+        if self.level_gpio_ready:
+            deadlines.append(self._last_level_query + 2.0)
+        if self._light_sensor:
+            deadlines.append(self._last_light_query + LIGHT_QUERY_PERIOD)
+        return min(deadlines)
+
     def _build_temperature_payload(self) -> list[Dict[str, Any]]:
         with self.state_lock:
             temps = {
@@ -1314,11 +1720,11 @@ class ReefController:
                         if now.tm_hour != hh_i or now.tm_min != mm_i:
                             continue
                         key = f"{hh_i:02d}:{mm_i:02d}|{method}|{url}"
-                        last_run = self._last_feeder_runs.get(key, 0)
+                        last_run = self._last_feeder_runs.get(key, NEVER)
                         # avoid double fire within same minute (loop runs every 10s)
-                        if time.time() - last_run < 70:
+                        if time.monotonic() - last_run < 70:
                             continue
-                        self._last_feeder_runs[key] = time.time()
+                        self._last_feeder_runs[key] = time.monotonic()
                         if url:
                             url_norm = self._normalize_url(url)
                             stop_pump = bool(
@@ -1387,10 +1793,10 @@ class ReefController:
                         if now.tm_hour != hh or now.tm_min != mm:
                             continue
                         key = f"{axis}|{normalized}"
-                        last_run = self._last_peristaltic_runs.get(key, 0.0)
-                        if time.time() - last_run < 70:
+                        last_run = self._last_peristaltic_runs.get(key, NEVER)
+                        if time.monotonic() - last_run < 70:
                             continue
-                        self._last_peristaltic_runs[key] = time.time()
+                        self._last_peristaltic_runs[key] = time.monotonic()
                         threading.Thread(
                             target=self._run_scheduled_peristaltic_cycle,
                             args=(axis, normalized, key),
@@ -1524,10 +1930,7 @@ class ReefController:
             else "automation"
         )
         try:
-            if method_norm == "POST":
-                resp = requests.post(url, timeout=REQUEST_TIMEOUT)
-            else:
-                resp = requests.get(url, timeout=REQUEST_TIMEOUT)
+            resp = self._http.request(method_norm, url, timeout=REQUEST_TIMEOUT)
             telemetry_events_logger.info(
                 "Feeder trigger %s %s status=%s key=%s",
                 method_norm,
@@ -1743,36 +2146,27 @@ class ReefController:
             "Auto-connect skipped: no /dev/ttyACM[0-1] detected or connection failed"
         )
 
-    def _tick_light_schedule(self) -> None:
+    def _tick_light_schedule(self) -> float:
+        """Applique l'horaire du jour ; renvoie le délai (s) jusqu'à la prochaine
+        transition, minuit compris (l'horaire du lendemain peut différer)."""
         with self.state_lock:
             auto = self.state.get("light_auto", True)
-            schedule = self.state.get("light_schedule", {})
+            minutes = self._light_minutes
         if not auto:
-            return
+            return LIGHT_SCHEDULER_MAX_SLEEP
 
         now = time.localtime()
         day_key = LIGHT_DAY_KEYS[now.tm_wday % len(LIGHT_DAY_KEYS)]
-        zone = schedule.get(day_key)
-        if not zone:
-            return
-
-        on_time = zone.get("on")
-        off_time = zone.get("off")
-        if not on_time or not off_time:
-            return
-
-        def to_minutes(val: str) -> Optional[int]:
-            try:
-                hh, mm = val.split(":", 1)
-                return int(hh) * 60 + int(mm)
-            except Exception:
-                return None
-
         now_min = now.tm_hour * 60 + now.tm_min
-        on_min = to_minutes(on_time)
-        off_min = to_minutes(off_time)
-        if on_min is None or off_min is None:
-            return
+        now_sec = now_min * 60 + now.tm_sec
+        zone = minutes.get(day_key)
+        if zone is None:
+            return 24 * 3600 - now_sec
+        on_min, off_min = zone
+        next_edge = min(
+            (edge for edge in (on_min, off_min) if edge > now_min), default=24 * 60
+        )
+        delay = float(next_edge * 60 - now_sec)
 
         if on_min <= off_min:
             should_on = on_min <= now_min < off_min
@@ -1790,33 +2184,37 @@ class ReefController:
                 source="automation",
                 fields={"state": should_on, "day_of_week": day_key},
             )
+        return delay
 
     # ---------- Serial helpers ----------
     def _handle_line(self, line: str) -> None:
         line = line.strip()
         if not line:
             return
-        logger.debug("<< %s", line)
+        if logger.isEnabledFor(logging.DEBUG):  # appelé pour chaque ligne série
+            logger.debug("<< %s", line)
         if line == "OK":
-            self.response_queue.put(("OK", None))
-            return
-        if line.startswith("ERR"):
-            payload = self._parse_error(line)
-            self.last_error = payload
-            self.response_queue.put(("ERR", payload))
+            self._resp_slot = ("OK", None)
+            self._resp_event.set()
             return
+        match = LINE_TAG_RE.match(line)
+        handler = self._line_handlers.get(match.group()) if match else None
+        if handler is not None:
+            handler(line)
+
+    def _apply_error_line(self, line: str) -> None:
+        payload = self._parse_error(line)
+        self.last_error = payload
+        self._resp_slot = ("ERR", payload)
+        self._resp_event.set()
+
+    def _apply_hello_line(self, line: str) -> None:
         if line.startswith("HELLO OK"):
             self._apply_status_line(line.split(";", 1)[1] if ";" in line else "")
-            return
+
+    def _apply_status_reply(self, line: str) -> None:
         if line.startswith("STATUS;"):
             self._apply_status_line(line.split(";", 1)[1])
-            return
-        if line.startswith("T_WATER"):
-            self._apply_temp_line(line)
-            return
-        if line.startswith("LEVEL"):
-            self._apply_level_line(line)
-            return
 
     def _parse_error(self, line: str) -> Dict[str, Any]:
         if line.startswith("ERR|"):
@@ -1840,126 +2238,92 @@ class ReefController:
         entries = payload.split(";") if payload else []
         with self.state_lock:
             for entry in entries:
-                if "=" not in entry:
+                key, sep, value = entry.partition("=")
+                if not sep:
                     continue
-                key, value = entry.split("=", 1)
                 key = key.lower()
-                if key == "mtr":
-                    prev = bool(self.state.get("motors_powered", False))
-                    new_state = value in ("1", "ON", "TRUE")
-                    self.state["motors_powered"] = new_state
-                    if new_state != prev:
-                        self._publish_device_event(
-                            device_type="peristaltic_power",
-                            device_id="main_stepper_power",
-                            source="status_line",
-                            fields={"state": new_state, "previous_state": prev},
-                        )
-                elif key == "fan_val":
-                    try:
-                        val = int(float(value))
-                        self.state["fan"] = val
-                        self.state["fan_on"] = val > 0
-                    except ValueError:
-                        pass
-                elif key == "auto_thresh":
-                    try:
-                        self.state["auto_thresh"] = float(value)
-                    except ValueError:
-                        pass
-                elif key == "pidw_tgt":
-                    try:
-                        self.state["tset_water"] = float(value)
-                    except ValueError:
-                        pass
-                elif key == "pidr_tgt":
-                    try:
-                        self.state["tset_res"] = float(value)
-                    except ValueError:
-                        pass
-                elif key == "level_low":
-                    self.state["lvl_low"] = value
-                elif key == "level_high":
-                    self.state["lvl_high"] = value
-                elif key == "level_alert":
-                    self.state["lvl_alert"] = value
-                elif key == "tempw":
-                    self.state["temp_1"] = self._sanitize_temp_text(
-                        value, self.state.get("temp_1", "--.-")
-                    )
-                elif key == "tempa":
-                    self.state["temp_3"] = self._sanitize_temp_text(
-                        value, self.state.get("temp_3", "--.-")
-                    )
-                elif key == "tempymin":
-                    self.state["temp_4"] = self._sanitize_temp_text(
-                        value, self.state.get("temp_4", "--.-")
-                    )
-                elif key == "tempymax":
-                    self.state["temp_2"] = self._sanitize_temp_text(
-                        value, self.state.get("temp_2", "--.-")
-                    )
-                elif key == "ph_v":
-                    try:
-                        self.state["ph_v"] = float(value)
-                        self.state["ph"] = self._ph_from_voltage(self.state["ph_v"])
-                    except ValueError:
-                        pass
-                elif key == "ph_raw":
+                spec = STATUS_FIELD_PARSERS.get(key)
+                if spec is not None:
+                    state_key, parse = spec
                     try:
-                        self.state["ph_raw"] = int(float(value))
+                        self.state[state_key] = parse(value)
                     except ValueError:
                         pass
-                elif key == "servo":
-                    try:
-                        self.state["servo_angle"] = int(float(value))
-                    except ValueError:
-                        pass
-                elif key in ("mtrx", "mtry", "mtrx", "mtre", "mtrz"):
-                    axis_map = {"mtrx": "X", "mtry": "Y", "mtrz": "Z", "mtre": "E"}
-                    axis_key = axis_map.get(key)
-                    if axis_key:
-                        prev = bool(
-                            self.state.get("peristaltic_state", {}).get(axis_key, False)
-                        )
-                        new_state = value in ("1", "ON", "TRUE", "true", "on")
-                        self.state.setdefault("peristaltic_state", {})[
-                            axis_key
-                        ] = new_state
-                        if new_state != prev:
-                            name, volume = self._get_peristaltic_profile(axis_key)
-                            device_id = name or axis_key
-                            self._publish_device_event(
-                                device_type="peristaltic_pump",
-                                device_id=device_id,
-                                source="status_line",
-                                fields={
-                                    "state": new_state,
-                                    "previous_state": prev,
-                                    "axis": axis_key,
-                                },
-                            )
-                            if new_state:
-                                self._publish_device_event(
-                                    device_type="peristaltic_pump",
-                                    device_id=device_id,
-                                    source="automation",
-                                    fields={
-                                        "product_name": name,
-                                        "volume_ml": volume,
-                                        "reason": "status_line",
-                                        "axis": axis_key,
-                                    },
-                                )
+                    continue
+                handler = self._status_key_handlers.get(key)
+                if handler is not None:
+                    handler(key, value)
+
+    def _apply_status_motor_power(self, key: str, value: str) -> None:
+        prev = bool(self.state.get("motors_powered", False))
+        new_state = value in ("1", "ON", "TRUE")
+        self.state["motors_powered"] = new_state
+        if new_state != prev:
+            self._publish_device_event(
+                device_type="peristaltic_power",
+                device_id="main_stepper_power",
+                source="status_line",
+                fields={"state": new_state, "previous_state": prev},
+            )
+
+    def _apply_status_fan(self, key: str, value: str) -> None:
+        try:
+            val = int(float(value))
+        except ValueError:
+            return
+        self.state["fan"] = val
+        self.state["fan_on"] = val > 0
+
+    def _apply_status_temp(self, key: str, value: str) -> None:
+        state_key = STATUS_TEMP_KEYS[key]
+        self.state[state_key] = self._sanitize_temp_text(
+            value, self.state.get(state_key, "--.-")
+        )
+
+    def _apply_status_ph_voltage(self, key: str, value: str) -> None:
+        try:
+            self.state["ph_v"] = float(value)
+        except ValueError:
+            return
+        self.state["ph"] = self._ph_from_voltage(self.state["ph_v"])
+
+    def _apply_status_axis(self, key: str, value: str) -> None:
+        axis_key = STATUS_AXIS_KEYS[key]
+        prev = bool(self.state.get("peristaltic_state", {}).get(axis_key, False))
+        new_state = value in ("1", "ON", "TRUE", "true", "on")
+        self.state.setdefault("peristaltic_state", {})[axis_key] = new_state
+        if new_state == prev:
+            return
+        name, volume = self._get_peristaltic_profile(axis_key)
+        device_id = name or axis_key
+        self._publish_device_event(
+            device_type="peristaltic_pump",
+            device_id=device_id,
+            source="status_line",
+            fields={
+                "state": new_state,
+                "previous_state": prev,
+                "axis": axis_key,
+            },
+        )
+        if new_state:
+            self._publish_device_event(
+                device_type="peristaltic_pump",
+                device_id=device_id,
+                source="automation",
+                fields={
+                    "product_name": name,
+                    "volume_ml": volume,
+                    "reason": "status_line",
+                    "axis": axis_key,
+                },
+            )
 
     def _apply_temp_line(self, line: str) -> None:
-        payload = line.replace("C", "")
-        parts = payload.split("|")
-        vals = {}
-        for part in parts:
-            if ":" in part:
-                k, v = part.split(":", 1)
-                vals[k.strip().lower()] = v.strip()
+        vals = {
+            match.group(1).lower(): match.group(2).strip()
+            for match in TEMP_FIELD_RE.finditer(line)
+        }
         with self.state_lock:
             self.state["temp_1"] = self._sanitize_temp_text(
                 vals.get("t_water"), self.state.get("temp_1", "--.-")
@@ -1984,16 +2348,19 @@ class ReefController:
                 )
             except Exception:
                 pass
+            heat_inputs = (self.state["temp_1"], self.state["temp_2"])
+        # Températures identiques à la dernière évaluation : chauffe et ventilation inchangées
+        if heat_inputs == self._last_heat_inputs:
+            return
+        self._last_heat_inputs = heat_inputs
         self._evaluate_heat_needs()
         self._evaluate_fan()
 
     def _apply_level_line(self, line: str) -> None:
-        tokens = line.replace("|", " ").split()
-        kv = {}
-        for token in tokens:
-            if "=" in token:
-                k, v = token.split("=", 1)
-                kv[k.strip().lower()] = v.strip()
+        kv = {
+            match.group(1).lower(): match.group(2)
+            for match in LEVEL_FIELD_RE.finditer(line)
+        }
         with self.state_lock:
             self.state["lvl_low"] = kv.get("low", self.state["lvl_low"])
             self.state["lvl_high"] = kv.get("high", self.state["lvl_high"])
@@ -2002,12 +2369,15 @@ class ReefController:
     def _send_command(self, command: str, timeout: float = 2.0) -> None:
         if not self.connected:
             raise RuntimeError("Non connecté")
-        logger.debug(">> %s", command)
-        self.serial.write(command)
-        try:
-            status, payload = self.response_queue.get(timeout=timeout)
-        except queue.Empty:
-            raise RuntimeError("Commande sans réponse")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(">> %s", command)
+        with self._cmd_lock:
+            self._resp_event.clear()
+            self._resp_slot = None
+            self.serial.write(command)
+            if not self._resp_event.wait(timeout) or self._resp_slot is None:
+                raise RuntimeError("Commande sans réponse")
+            status, payload = self._resp_slot
         if status != "OK":
             raise RuntimeError(payload.get("message", "Erreur Mega"))
         self.last_error = None
@@ -2015,11 +2385,11 @@ class ReefController:
     def _update_heater_outputs(self) -> None:
         if not self.connected:
             return
+        # Seules deux valeurs sont lues : pas de copie des dictionnaires de chauffe
         with self.state_lock:
-            targets = self.state.get("heat_targets", {}).copy()
-            states = self.state.get("heat_state", {}).copy()
-        cmd_water = targets.get("temp_1", 0.0) if states.get("temp_1") else 0.0
-        cmd_res = targets.get("temp_2", 0.0) if states.get("temp_2") else 0.0
+            heating = self.state.get("heat_state", {}).get("temp_1")
+            target = self.state.get("heat_targets", {}).get("temp_1", 0.0)
+        cmd_water = target if heating else 0.0
         # Pilotage via relais GPIO (NC) : ON si temp_1 chauffe
         heat_on = cmd_water > 0
         self._drive_heat_gpio(heat_on)
@@ -2045,7 +2415,7 @@ class ReefController:
                 "temp_2": self.state.get("temp_2"),
             }
             states = self.state.get("heat_state", {}).copy()
-        hysteresis = float(self.state.get("heat_hyst", 0.3) or 0.3)
+            hysteresis = float(self.state.get("heat_hyst", 0.3) or 0.3)
         updated = False
         prev_states = states.copy()
         for zone, temp_raw in temps.items():
@@ -2141,7 +2511,7 @@ class ReefController:
         data: Dict[str, Any] = {}
         if PH_CALIBRATION_PATH.exists():
             try:
-                data = json.loads(PH_CALIBRATION_PATH.read_text(encoding="utf-8"))
+                data = _loads_config(PH_CALIBRATION_PATH)
             except Exception as exc:
                 logger.warning("Unable to load pH calibration: %s", exc)
         points: Dict[str, Dict[str, Any]] = {}
@@ -2181,7 +2551,7 @@ class ReefController:
             "b": self.ph_calibration.get("b", DEFAULT_PH_OFFSET),
         }
         try:
-            PH_CALIBRATION_PATH.write_text(json.dumps(data, indent=2), encoding="utf-8")
+            _write_json_atomic(PH_CALIBRATION_PATH, _dumps_config(data))
         except Exception as exc:
             logger.error("Unable to save pH calibration: %s", exc)
 
@@ -2258,13 +2628,15 @@ class ReefController:
     def _send_query(self, command: str) -> None:
         if not self.connected:
             raise RuntimeError("Non connecté")
-        logger.debug(">> %s", command)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(">> %s", command)
         self.serial.write(command)
 
     # ---------- Connection ----------
     def connect(self, port: str) -> None:
         hello, status = self.serial.open(port)
         self.connected = True
+        self._telemetry_wakeup.set()
         self.status_text = f"Connecté : {port}"
         self.last_error = None
         if ";" in status:
@@ -2282,8 +2654,8 @@ class ReefController:
         port = self.serial.port
         self.serial.close()
         self.connected = False
-        self._last_temp_query = 0.0
-        self._last_level_query = 0.0
+        self._last_temp_query = NEVER
+        self._last_level_query = NEVER
         self.status_text = "Déconnecté"
         self._drive_heat_gpio(False)
         self._drive_fan_gpio(False)
@@ -2498,11 +2870,7 @@ class ReefController:
         signed_steps = -steps_abs if backwards else steps_abs
         self._send_command(f"PUMP {axis_key} {signed_steps} {command_speed}")
         if auto_off:
-            threading.Thread(
-                target=self._auto_motor_off_delay,
-                args=(steps_abs, command_speed),
-                daemon=True,
-            ).start()
+            self._schedule_motor_off(steps_abs, command_speed)
         name, default_volume = self._get_peristaltic_profile(axis_key)
         volume = default_volume
         if volume_override is not None:
@@ -2609,13 +2977,29 @@ class ReefController:
             minute_label=minute_label,
         )
 
-    def _auto_motor_off_delay(self, steps: int, speed: int) -> None:
+    def _schedule_motor_off(self, steps: int, speed: int) -> None:
         duration = (steps * speed * 2) / 1_000_000.0
-        time.sleep(duration + 0.5)
-        try:
-            self._send_command("MTR OFF", timeout=1.0)
-        except Exception:
-            pass
+        deadline = time.monotonic() + duration + 0.5
+        with self._motor_off_cond:
+            # Un job plus long déjà en cours garde son échéance
+            if self._motor_off_deadline is None or deadline > self._motor_off_deadline:
+                self._motor_off_deadline = deadline
+                self._motor_off_cond.notify()
+
+    def _motor_off_loop(self) -> None:
+        while True:
+            with self._motor_off_cond:
+                while self._motor_off_deadline is None:
+                    self._motor_off_cond.wait()
+                remaining = self._motor_off_deadline - time.monotonic()
+                if remaining > 0:
+                    self._motor_off_cond.wait(remaining)
+                    continue
+                self._motor_off_deadline = None
+            try:
+                self._send_command("MTR OFF", timeout=1.0)
+            except Exception:
+                pass
 
     def emergency_stop(self) -> None:
         self._send_command("MTR OFF")
@@ -2696,6 +3080,7 @@ class ReefController:
                 entry["on"] = on_time
             if off_time is not None:
                 entry["off"] = off_time
+            self._refresh_light_minutes()
         self._save_light_schedule()
         self._publish_setting_change(
             setting_group="light_schedule",
@@ -2727,6 +3112,7 @@ class ReefController:
     def set_light_auto(self, enable: bool) -> None:
         with self.state_lock:
             self.state["light_auto"] = enable
+        self._light_wakeup.set()
         self._publish_setting_change(
             setting_group="light", setting_name="auto_mode", value=enable
         )
@@ -2961,15 +3347,17 @@ class ReefController:
 
     # ---------- State ----------
     def get_state(self) -> Dict[str, Any]:
+        # Copie superficielle construite d'un bloc : le verrou n'est tenu que le temps
+        # de recopier les références (le thread série attend ce même verrou)
         with self.state_lock:
             payload = {
                 "status": self.status_text,
                 "connected": self.connected,
                 "mega_error": self.last_error,
+                **self.state,
+                "global_speed": self.global_speed,
+                "heat_targets": dict(self.state.get("heat_targets", {})),
             }
-            payload.update(self.state)
-            payload["global_speed"] = self.global_speed
-            payload["heat_targets"] = self.state.get("heat_targets", {}).copy()
         with self._peristaltic_runs_lock:
             payload["peristaltic_history"] = {
                 axis: [entry.copy() for entry in self._peristaltic_last_runs.get(axis, [])]
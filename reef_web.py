@@ -3,6 +3,7 @@ import base64
 import json
 import math
 import logging
+import signal
 import subprocess
 import sys
 import threading
@@ -849,6 +850,32 @@ atexit.register(_close_telemetry)
 
 atexit.register(camera_manager.shutdown)
 
+atexit.register(controller.flush_pending_saves)
+
+
+def _handle_sigterm(signum: int, frame: Any) -> None:
+
+    # atexit ne s'exécute pas sur un signal non géré (arrêt systemd) : on vide les
+
+    # sauvegardes différées puis on sort proprement (les handlers atexit suivent)
+
+    controller.flush_pending_saves()
+
+    sys.exit(0)
+
+
+
+
+
+try:
+
+    signal.signal(signal.SIGTERM, _handle_sigterm)
+
+except ValueError:
+
+    pass  # import hors du thread principal : pas de gestionnaire de signal
+
+
 
 
 